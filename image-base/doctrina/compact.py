@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+def compact_frame(frame, float_dtype='float32', category_ratio=0.5):
+    """
+    Downcasts the columns of a frame (or a series) to a compact representation:
+    floats to float_dtype, integers to the smallest signed width that holds their values,
+    and strings to categoricals when they repeat enough.
+    :param frame:
+    :param float_dtype: float32 or float16
+    :param category_ratio: the maximum ratio of unique values to rows for a string column to become categorical,
+    or None to keep strings as they are
+    :return: the compacted frame
+    """
+    if isinstance(frame, pd.Series):
+        return compact_frame(frame.to_frame(), float_dtype, category_ratio).iloc[:, 0]
+
+    frame = frame.copy(deep=False)
+
+    for i in range(frame.shape[1]):
+        column = frame.iloc[:, i]
+        dtype = column.dtype
+
+        if pd.api.types.is_float_dtype(dtype):
+            if dtype.itemsize > np.dtype(float_dtype).itemsize and fits_float(column, float_dtype):
+                frame.isetitem(i, column.astype(float_dtype))
+
+        elif pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+            frame.isetitem(i, pd.to_numeric(column, downcast='integer'))
+
+        elif category_ratio is not None and (
+                # Object columns may hold lists or dicts, which cannot be counted or categorized.
+                not isinstance(dtype, pd.CategoricalDtype) and pd.api.types.infer_dtype(column) == 'string'
+        ):
+            if column.shape[0] > 0 and column.nunique() / column.shape[0] <= category_ratio:
+                frame.isetitem(i, column.astype('category'))
+
+    return frame
+
+
+def fits_float(column, float_dtype) -> bool:
+    """
+    :return: whether the finite values of the column stay finite in float_dtype
+    """
+    values = np.abs(column.to_numpy(dtype='float64', na_value=np.nan))
+    values = values[np.isfinite(values)]
+    return values.shape[0] == 0 or values.max() <= np.finfo(float_dtype).max
+
+
+def frame_memory(frame) -> int:
+    """
+    :param frame:
+    :return: the number of bytes held by the frame, including the Python strings
+    """
+    memory = frame.memory_usage(deep=True)
+    return int(memory.sum()) if isinstance(memory, pd.Series) else int(memory)
+
+
+def compact_frames(frames: dict, **kwargs) -> dict:
+    """
+    Compacts frames in place and reports the memory saved by each of them.
+    :param frames: the frames by name, updated with the compacted frames
+    :param kwargs: passed to compact_frame
+    :return: the bytes before and after compaction by name
+    """
+    report = {}
+
+    for name, frame in frames.items():
+        if frame is None:
+            continue
+
+        before = frame_memory(frame)
+        frames[name] = compact_frame(frame, **kwargs)
+        after = frame_memory(frames[name])
+
+        report[name] = {'before': before, 'after': after, 'saved': before - after}
+
+    return report
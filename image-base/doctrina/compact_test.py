@@ -0,0 +1,80 @@
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+from doctrina.compact import compact_frame, compact_frames
+from doctrina.dataset import FeaturesDataset
+from doctrina.util import load_predictions, save_predictions
+
+
+class CompactTest(TestCase):
+    def test_downcast(self):
+        frame = pd.DataFrame({
+            "f": np.arange(4, dtype="float64"),
+            "i": np.arange(4, dtype="int64"),
+            "s": ["a", "b", "a", "a"],
+        })
+        compacted = compact_frame(frame)
+
+        self.assertEqual(np.float32, compacted["f"].dtype)
+        self.assertEqual(np.int8, compacted["i"].dtype)
+        self.assertIsInstance(compacted["s"].dtype, pd.CategoricalDtype)
+        self.assertEqual(np.float64, frame["f"].dtype)
+
+    def test_out_of_range_floats_keep_dtype(self):
+        compacted = compact_frame(pd.DataFrame({"f": [1e300, 1.0, np.inf]}))
+        self.assertEqual(np.float64, compacted["f"].dtype)
+        self.assertEqual(1e300, compacted["f"][0])
+
+    def test_object_columns_with_lists(self):
+        frame = pd.DataFrame({"l": [[1], [1], [2], [1]], "d": [{"a": 1}] * 4})
+        compacted = compact_frame(frame)
+        self.assertEqual(object, compacted["l"].dtype)
+        self.assertEqual(object, compacted["d"].dtype)
+
+    def test_report(self):
+        frames = {"x": pd.DataFrame({"f": np.zeros(100)}), "y": None}
+        report = compact_frames(frames)
+
+        self.assertEqual(["x"], list(report))
+        self.assertEqual(report["x"]["before"] - report["x"]["after"], report["x"]["saved"])
+        self.assertGreater(report["x"]["saved"], 0)
+        self.assertEqual(np.float32, frames["x"]["f"].dtype)
+
+
+class CompactH5Test(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+
+        self.frame = compact_frame(
+            pd.DataFrame({"f": np.linspace(0, 1, 8), "s": ["a", "b"] * 4}),
+            float_dtype="float16",
+        )
+
+    def test_dataset_round_trip(self):
+        dataset = FeaturesDataset()
+        for split in ["train", "validate", "test"]:
+            setattr(dataset, f"{split}_X", self.frame)
+        dataset.to_h5_workdir(self.workdir)
+
+        restored = FeaturesDataset.from_h5_workdir(self.workdir)
+        self.assertEqual(np.float16, restored.test_X["f"].dtype)
+        self.assertIsInstance(restored.test_X["s"].dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(self.frame, restored.test_X)
+
+    def test_predictions_round_trip(self):
+        dataset = FeaturesDataset()
+        for i, split in enumerate(["train", "validate", "test"]):
+            setattr(dataset, f"{split}_X", self.frame.assign(f=self.frame["f"] + np.float16(i)))
+
+        model = mock.Mock()
+        model.predict.side_effect = lambda X: X[["f"]].to_numpy()
+        save_predictions(self.workdir, model, dataset)
+
+        for split, y_hat in zip(["train", "validate", "test"], load_predictions(self.workdir)):
+            self.assertEqual(np.float16, y_hat.dtype)
+            np.testing.assert_array_equal(getattr(dataset, f"{split}_X")["f"].to_numpy(), y_hat.to_numpy())
@@ -1,58 +1,511 @@
+import json
+import os
+import threading
 import typing
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from doctrina.compact import compact_frame, compact_frames
+from doctrina.hdf import read_h5, write_h5
+from doctrina.stream import iter_h5_frames, iter_pq_frames, shuffle_stream, to_numpy_stream, zip_streams
+from doctrina.versions import get_files_version
+
+
+def read_parquet(path, columns=None, row_range=None, memory_map=False):
+    """
+    Reads a parquet file, pushing the column projection and the row range down to the reader,
+    so that only the requested columns of the overlapping row groups are read.
+    With memory_map, pandas can reuse the Arrow buffers without copying where dtypes allow.
+    :param path:
+    :param columns: the columns to read, or None for all columns
+    :param row_range: the (start, stop) range of rows to read, or None for all rows
+    :param memory_map:
+    :return:
+    """
+    file = pq.ParquetFile(path, memory_map=memory_map)
+
+    if row_range is None:
+        table = file.read(columns=columns, use_pandas_metadata=True)
+    else:
+        num_rows = file.metadata.num_rows
+        start = min(row_range[0] or 0, num_rows)
+        stop = num_rows if row_range[1] is None else max(start, min(row_range[1], num_rows))
+
+        row_groups, offset = find_row_groups(file.metadata, start, stop)
+        table = file.read_row_groups(row_groups, columns=columns, use_pandas_metadata=True)
+        table = table.slice(start - offset, stop - start)
+
+    if memory_map:
+        frame = table.to_pandas(split_blocks=True, self_destruct=True)
+    else:
+        frame = table.to_pandas()
+
+    # Arrow rebuilds a stored RangeIndex from zero after slicing.
+    index_columns = (file.schema_arrow.pandas_metadata or {}).get('index_columns', [])
+    if row_range is not None and len(index_columns) == 1 and isinstance(index_columns[0], dict):
+        index = index_columns[0]
+        first = index['start'] + start * index['step']
+        frame.index = pd.RangeIndex(
+            first,
+            first + frame.shape[0] * index['step'],
+            index['step'],
+            name=index['name'],
+        )
+
+    return frame
+
+
+def find_row_groups(metadata, start, stop) -> tuple:
+    """
+    :param metadata: the metadata of a parquet file
+    :param start:
+    :param stop:
+    :return: the row groups that overlap the rows from start to stop, and the first row of the first of them
+    """
+    row_groups = []
+    offset = 0
+    group_start = 0
+    for i in range(metadata.num_row_groups):
+        group_stop = group_start + metadata.row_group(i).num_rows
+        if group_stop > start and group_start < stop:
+            if len(row_groups) == 0:
+                offset = group_start
+            row_groups.append(i)
+        group_start = group_stop
+
+    return row_groups, offset
+
+
+def to_row_range(row_range=None, nrows=None):
+    if nrows is not None:
+        return 0, nrows
+
+    return row_range
+
+
+def read_options(kwargs: dict) -> dict:
+    """
+    :param kwargs:
+    :return: the parquet read options among the given keyword arguments
+    """
+    return {k: v for k, v in kwargs.items() if k in ('columns', 'row_range', 'nrows')}
+
+
+def for_part(option, name):
+    """
+    :param option: either a single value for all parts, or a dict of values by part name
+    :param name:
+    :return: the value of the option for the given part
+    """
+    if isinstance(option, dict):
+        return option.get(name)
+
+    return option
+
+
+def build_stream(streams, batch_size, shuffle_buffer=None, seed=None, as_numpy=False):
+    batches = zip_streams(streams, batch_size)
+
+    if shuffle_buffer is not None:
+        batches = shuffle_stream(batches, shuffle_buffer, seed=seed)
+
+    if as_numpy:
+        batches = to_numpy_stream(batches)
+
+    return batches
+
+
+def load_compact(loader, options: dict):
+    return compact_frame(loader(), **options)
+
+
+# Parquet stores half floats only from pyarrow 15, which is newer than the pinned versions.
+PQ_HALF_FLOATS = int(pa.__version__.split('.')[0]) >= 15
+
+
+def to_pq_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param frame:
+    :return: the frame with its float16 columns as float32 where parquet cannot store them, see compact_frame
+    """
+    if PQ_HALF_FLOATS:
+        return frame
+
+    halves = [i for i, dtype in enumerate(frame.dtypes) if dtype == np.float16]
+    if len(halves) == 0:
+        return frame
+
+    frame = frame.copy(deep=False)
+    for i in halves:
+        frame.isetitem(i, frame.iloc[:, i].astype('float32'))
+
+    return frame
+
+
+def pq_store_path(workdir, store_name, frame_name):
+    return f"{workdir}/{store_name}_{frame_name}.parquet"
+
+
+def unify_pq_schemas(schemas: list):
+    """
+    Promotes the schemas of the segments of a frame to one schema,
+    where mixed integer and floating columns become float64 and null columns take the type of the others.
+    :param schemas:
+    :return: the schema of the store, with the pandas metadata of the first schema
+    :raises ValueError: if the types of a column cannot be promoted
+    """
+    types = OrderedDict()
+    for schema in schemas:
+        for field in schema:
+            types.setdefault(field.name, [])
+            if field.type not in types[field.name]:
+                types[field.name].append(field.type)
+
+    fields = []
+    for name, field_types in types.items():
+        field_types = [t for t in field_types if not pa.types.is_null(t)] or field_types
+
+        if len(field_types) == 1:
+            field_type = field_types[0]
+        elif all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in field_types):
+            field_type = pa.float64() if any(pa.types.is_floating(t) for t in field_types) else pa.int64()
+        else:
+            raise ValueError(f'Column {name} has incompatible types in the segments: {field_types}')
+
+        fields.append(pa.field(name, field_type))
+
+    return pa.schema(fields, metadata=schemas[0].metadata)
+
+
+def load_pq_store_index(workdir, store_name='segments') -> dict:
+    """
+    :param workdir:
+    :param store_name:
+    :return: the frame names, and the rows and row groups of every segment in the store
+    """
+    with open(f"{workdir}/{store_name}.json", 'r') as f:
+        return json.loads(f.read(), object_pairs_hook=OrderedDict)
+
+
+def assign_row_groups(metadata, ranges: list) -> list:
+    """
+    :param metadata: the metadata of a written store file
+    :param ranges: the (start, stop) rows of the segments, in the order they were written
+    :return: the ids of the row groups of each segment
+    """
+    groups = [[] for _ in ranges]
+    segment = 0
+    group_start = 0
+
+    for i in range(metadata.num_row_groups):
+        num_rows = metadata.row_group(i).num_rows
+        # Empty row groups hold no rows of any segment.
+        if num_rows > 0:
+            while ranges[segment][1] <= group_start:
+                segment += 1
+            groups[segment].append(i)
+        group_start += num_rows
+
+    return groups
+
+
+class PqStoreReader:
+    """
+    Reads the frames of the segments of a consolidated store.
+    The footer of a store file describes the row groups of every segment, so it is parsed only once,
+    and each thread opens each file only once.
+    """
+
+    def __init__(self, workdir, store_name='segments'):
+        self.workdir = workdir
+        self.store_name = store_name
+        self.index = load_pq_store_index(workdir, store_name)
+        self.metadata = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get_file(self, frame_name) -> pq.ParquetFile:
+        path = pq_store_path(self.workdir, self.store_name, frame_name)
+
+        with self.lock:
+            if frame_name not in self.metadata:
+                self.metadata[frame_name] = pq.read_metadata(path)
+
+        files = self.local.__dict__.setdefault('files', {})
+        if frame_name not in files:
+            files[frame_name] = pq.ParquetFile(path, metadata=self.metadata[frame_name])
+
+        return files[frame_name]
+
+    def read(self, segment_name, frame_name, columns=None, row_range=None) -> pd.DataFrame:
+        """
+        :param segment_name:
+        :param frame_name:
+        :param columns:
+        :param row_range: the (start, stop) range of rows within the segment
+        :return:
+        """
+        entry = self.index['segments'][segment_name][frame_name]
+        file = self.get_file(frame_name)
+
+        row_groups = entry['row_groups']
+        segment_start, segment_stop = 0, entry['rows'][1] - entry['rows'][0]
+
+        start, stop = segment_start, segment_stop
+        if row_range is not None:
+            if row_range[0] is not None:
+                start = min(segment_start + row_range[0], segment_stop)
+            if row_range[1] is not None:
+                stop = max(start, min(segment_start + row_range[1], segment_stop))
+
+        table = file.read_row_groups(row_groups, columns=columns, use_pandas_metadata=True)
+        return table.slice(start, stop - start).to_pandas()
+
+
+def get_pq_store_reader(workdir, store_name='segments') -> PqStoreReader:
+    """
+    :param workdir:
+    :param store_name:
+    :return: the reader of the store, which is cached per process until the store is written again.
+    The reader is shared between callers, so its index must not be modified.
+    """
+    paths = [f"{workdir}/{store_name}.json"] + sorted(
+        f"{workdir}/{name}" for name in os.listdir(workdir)
+        if name.startswith(f"{store_name}_") and name.endswith('.parquet')
+    )
+
+    version = get_files_version(paths)
+    if version is None:
+        return PqStoreReader(workdir, store_name)
+
+    return load_pq_store_reader(workdir, store_name, version)
+
+
+@lru_cache(maxsize=32)
+def load_pq_store_reader(workdir, store_name, version) -> PqStoreReader:
+    return PqStoreReader(workdir, store_name)
 
 
 class Dataset:
+    def __getattr__(self, name):
+        # Only called for splits that are not loaded yet.
+        loaders = self.__dict__.get('_loaders', {})
+        if name not in loaders:
+            raise AttributeError(name)
+
+        frame = loaders[name]()
+        self.__dict__[name] = frame
+        return frame
+
+    def splits(self) -> list:
+        """
+        :return: the names of all splits, including the ones not loaded yet
+        """
+        names = [a for a in self.__dict__ if not a.startswith('_')]
+        names += [a for a in self.__dict__.get('_loaders', {}) if a not in names]
+        return names
+
+    def is_loaded(self, name) -> bool:
+        return name in self.__dict__
+
+    def release(self, *names):
+        """
+        Drops the given splits (or all splits) from memory.
+        Lazy splits are loaded again on the next access.
+        :param names:
+        """
+        loaders = self.__dict__.get('_loaders', {})
+
+        for name in names or self.splits():
+            if name in loaders:
+                self.__dict__.pop(name, None)
+            else:
+                self.__dict__[name] = None
+
+    def _set_loaders(self, loaders: dict):
+        for name in loaders:
+            self.__dict__.pop(name, None)
+
+        self.__dict__['_loaders'] = loaders
+
+    def _share_split(self, target: 'Dataset', there, here):
+        """
+        Copies a split into another dataset without loading it.
+        """
+        target_loaders = target.__dict__.setdefault('_loaders', {})
+
+        if self.is_loaded(here):
+            target.__dict__[there] = self.__dict__[here]
+            target_loaders.pop(there, None)
+        else:
+            target.__dict__.pop(there, None)
+            target_loaders[there] = self._loaders[here]
+
+    def compact(self, float_dtype='float32', category_ratio=0.5) -> dict:
+        """
+        Downcasts the loaded splits to a compact representation, see compact_frame.
+        Lazy splits are compacted whenever they are loaded.
+        :param float_dtype: float32 or float16, which is written to parquet as float32 before pyarrow 15
+        :param category_ratio: see compact_frame
+        :return: the bytes before and after compaction by split
+        """
+        options = {'float_dtype': float_dtype, 'category_ratio': category_ratio}
+
+        loaded = {a: self.__dict__[a] for a in self.splits() if self.is_loaded(a)}
+        report = compact_frames(loaded, **options)
+        self.__dict__.update(loaded)
+
+        loaders = self.__dict__.get('_loaders', {})
+        for a, loader in loaders.items():
+            loaders[a] = partial(load_compact, loader, options)
+
+        return report
+
     @classmethod
     def concat(cls, aa, bb):
         out = cls()
 
-        for a in aa.__dict__:
-            out.__dict__[a] = aa.__dict__[a]
+        for a in aa.splits():
+            aa._share_split(out, a, a)
 
-        for b in bb.__dict__:
-            out.__dict__[b] = bb.__dict__[b]
+        for b in bb.splits():
+            bb._share_split(out, b, b)
 
         return out
 
     @classmethod
-    def from_h5_workdir(cls, workdir):
+    def from_h5_workdir(cls, workdir, lazy=False):
         """
         :param workdir:
+        :param lazy: if True, each split is read on the first access
         :return:
         """
         dataset = cls()
-        for a in dataset.__dict__:
-            dataset.__dict__[a] = pd.read_hdf(f"{workdir}/dataset.h5", a)
+        path = f"{workdir}/dataset.h5"
+
+        if lazy:
+            dataset._set_loaders({
+                a: partial(pd.read_hdf, path, a)
+                for a in dataset.splits()
+            })
+        else:
+            dataset.__dict__.update(read_h5(path, dataset.splits()))
+
         return dataset
 
     @classmethod
-    def from_pq_workdir(cls, workdir):
+    def from_pq_workdir(cls, workdir, lazy=False, columns=None, row_range=None, nrows=None):
         """
         :param workdir:
+        :param lazy: if True, each split is memory-mapped and read on the first access
+        :param columns: the columns to read, either for all splits or a dict by split name
+        :param row_range: the (start, stop) range of rows to read, either for all splits or a dict by split name
+        :param nrows: shorthand for row_range=(0, nrows)
         :return:
         """
         dataset = cls()
-        for a in dataset.__dict__:
-            dataset.__dict__[a] = pd.read_parquet(f"{workdir}/{a}.parquet")
+        row_range = to_row_range(row_range, nrows)
+
+        loaders = {
+            a: partial(
+                read_parquet,
+                f"{workdir}/{a}.parquet",
+                columns=for_part(columns, a),
+                row_range=for_part(row_range, a),
+                memory_map=lazy,
+            )
+            for a in dataset.splits()
+        }
+
+        if lazy:
+            dataset._set_loaders(loaders)
+        else:
+            for a, loader in loaders.items():
+                dataset.__dict__[a] = loader()
+
         return dataset
 
-    def to_h5_workdir(self, workdir):
+    @classmethod
+    def stream_pq_workdir(
+            cls,
+            workdir,
+            splits,
+            batch_size,
+            columns=None,
+            shuffle_buffer=None,
+            seed=None,
+            as_numpy=False
+    ):
         """
+        Streams aligned batches of the given splits straight from the parquet record batches,
+        without loading the splits into memory.
         :param workdir:
+        :param splits: the splits to align, such as ['train_X', 'train_y']
+        :param batch_size:
+        :param columns: the columns to read, either for all splits or a dict by split name
+        :param shuffle_buffer: the number of rows to shuffle among, or None to keep the file order
+        :param seed:
+        :param as_numpy: if True, yields NumPy arrays, as expected by Keras generators
+        :return: a generator of tuples with one frame per split
         """
-        for a in self.__dict__:
-            self.__dict__[a].to_hdf(f"{workdir}/dataset.h5", a)
+        streams = [
+            iter_pq_frames(f"{workdir}/{a}.parquet", batch_size, columns=for_part(columns, a))
+            for a in splits
+        ]
+        return build_stream(streams, batch_size, shuffle_buffer, seed, as_numpy)
+
+    @classmethod
+    def stream_h5_workdir(cls, workdir, splits, batch_size, shuffle_buffer=None, seed=None, as_numpy=False):
+        """
+        Streams aligned batches of the given splits from dataset.h5 in chunks of rows,
+        without loading the splits into memory.
+        :param workdir:
+        :param splits: the splits to align, such as ['train_X', 'train_y']
+        :param batch_size:
+        :param shuffle_buffer: the number of rows to shuffle among, or None to keep the file order
+        :param seed:
+        :param as_numpy: if True, yields NumPy arrays, as expected by Keras generators
+        :return: a generator of tuples with one frame per split
+        """
+        streams = [iter_h5_frames(f"{workdir}/dataset.h5", a, batch_size) for a in splits]
+        return build_stream(streams, batch_size, shuffle_buffer, seed, as_numpy)
+
+    def to_h5_workdir(self, workdir, format='fixed', complib='blosc:zstd', complevel=5, replace=False) -> dict:
+        """
+        Writes all splits into dataset.h5, opening the file only once.
+        The splits of other datasets in the file are kept, for example the features and the targets of a workdir.
+        :param workdir:
+        :param format: fixed or table
+        :param complib: the compression library, or None to disable compression
+        :param complevel:
+        :param replace: if True, the file is replaced, which drops the splits of other datasets
+        and the space left by the rewritten splits
+        :return: the written keys, bytes and seconds, see write_h5
+        """
+        frames = {a: getattr(self, a) for a in self.splits()}
+
+        return write_h5(
+            f"{workdir}/dataset.h5",
+            frames,
+            format=format,
+            complib=complib,
+            complevel=complevel,
+            mode='w' if replace else 'a',
+        )
 
     def to_pq_workdir(self, workdir):
         """
         :param workdir:
         """
-        for a in self.__dict__:
-            self.__dict__[a].to_parquet(f"{workdir}/{a}.parquet")
+        for a in self.splits():
+            to_pq_frame(getattr(self, a)).to_parquet(f"{workdir}/{a}.parquet")
 
 
 class Segment:
@@ -66,22 +519,83 @@ class Segment:
     def __setitem__(self, key, value):
         self.frames[key] = value
 
+    @staticmethod
+    def pq_path(workdir, segment_name, frame_name):
+        return f"{workdir}/{segment_name}_{frame_name}.parquet"
+
+    def compact(self, float_dtype='float32', category_ratio=0.5) -> dict:
+        """
+        Downcasts the frames to a compact representation, see compact_frame.
+        :param float_dtype: float32 or float16, which is written to parquet as float32 before pyarrow 15
+        :param category_ratio: see compact_frame
+        :return: the bytes before and after compaction by frame
+        """
+        return compact_frames(self.frames, float_dtype=float_dtype, category_ratio=category_ratio)
+
     def to_pq_workdir(self, workdir):
         for name, frame in self.frames.items():
-            filename = f"{self.segment_name}_{name}.parquet"
-            self.frames[name].to_parquet(f"{workdir}/{filename}")
+            to_pq_frame(frame).to_parquet(self.pq_path(workdir, self.segment_name, name))
 
     @classmethod
-    def from_pq_workdir(cls, workdir, segment_name, frame_names):
+    def from_pq_workdir(cls, workdir, segment_name, frame_names, columns=None, row_range=None, nrows=None):
         """
         :param workdir:
+        :param segment_name:
+        :param frame_names:
+        :param columns: the columns to read, either for all frames or a dict by frame name
+        :param row_range: the (start, stop) range of rows to read, either for all frames or a dict by frame name
+        :param nrows: shorthand for row_range=(0, nrows)
         :return:
         """
         segment = cls(segment_name)
+        row_range = to_row_range(row_range, nrows)
 
         for frame_name in frame_names:
-            filename = f"{segment_name}_{frame_name}.parquet"
-            segment.frames[frame_name] = pd.read_parquet(f"{workdir}/{filename}")
+            segment.frames[frame_name] = read_parquet(
+                cls.pq_path(workdir, segment_name, frame_name),
+                columns=for_part(columns, frame_name),
+                row_range=for_part(row_range, frame_name),
+            )
+
+        return segment
+
+    @classmethod
+    def from_pq_store(
+            cls,
+            workdir,
+            segment_name,
+            frame_names=None,
+            columns=None,
+            row_range=None,
+            nrows=None,
+            store_name='segments'
+    ):
+        """
+        Reads one segment from a consolidated store written by SegmentDataset.to_pq_store,
+        without scanning the other segments.
+        :param workdir:
+        :param segment_name:
+        :param frame_names: the frames to read, or None for all frames of the segment
+        :param columns: the columns to read, either for all frames or a dict by frame name
+        :param row_range: the (start, stop) range of rows to read, either for all frames or a dict by frame name
+        :param nrows: shorthand for row_range=(0, nrows)
+        :param store_name:
+        :return:
+        """
+        reader = get_pq_store_reader(workdir, store_name)
+        segment = cls(segment_name)
+        row_range = to_row_range(row_range, nrows)
+
+        if frame_names is None:
+            frame_names = list(reader.index['segments'][segment_name])
+
+        for frame_name in frame_names:
+            segment.frames[frame_name] = reader.read(
+                segment_name,
+                frame_name,
+                columns=for_part(columns, frame_name),
+                row_range=for_part(row_range, frame_name),
+            )
 
         return segment
 
@@ -90,14 +604,14 @@ class RegressionSegment(Segment):
     @classmethod
     def from_pq_workdir(cls, workdir, segment_name, **kwargs):
         frame_names = ["x", "y"]
-        return Segment.from_pq_workdir(workdir, segment_name, frame_names)
+        return Segment.from_pq_workdir(workdir, segment_name, frame_names, **read_options(kwargs))
 
 
 class FeatureSegment(Segment):
     @classmethod
     def from_pq_workdir(cls, workdir, segment_name, **kwargs) -> 'FeatureSegment':
         frame_names = ["x"]
-        return super(FeatureSegment, cls).from_pq_workdir(workdir, segment_name, frame_names)
+        return super(FeatureSegment, cls).from_pq_workdir(workdir, segment_name, frame_names, **read_options(kwargs))
 
     def as_reconstruction(self) -> RegressionSegment:
         segment = RegressionSegment(self.segment_name)
@@ -110,14 +624,14 @@ class TargetSegment(Segment):
     @classmethod
     def from_pq_workdir(cls, workdir, segment_name, **kwargs):
         frame_names = ["y"]
-        return Segment.from_pq_workdir(workdir, segment_name, frame_names)
+        return Segment.from_pq_workdir(workdir, segment_name, frame_names, **read_options(kwargs))
 
 
 class DenoisingSegment(Segment):
     @classmethod
     def from_pq_workdir(cls, workdir, segment_name, **kwargs) -> 'DenoisingSegment':
         frame_names = ['clean_x', 'noisy_x']
-        return super(DenoisingSegment, cls).from_pq_workdir(workdir, segment_name, frame_names)
+        return super(DenoisingSegment, cls).from_pq_workdir(workdir, segment_name, frame_names, **read_options(kwargs))
 
     def to_regression_segment(self) -> RegressionSegment:
         segment = RegressionSegment(self.segment_name)
@@ -129,7 +643,7 @@ class DenoisingSegment(Segment):
 class ReconstructionSegment(Segment):
     @classmethod
     def from_pq_workdir(cls, workdir, segment_name, **kwargs) -> 'ReconstructionSegment':
-        return super(ReconstructionSegment, cls).from_pq_workdir(workdir, segment_name, ['x'])
+        return super(ReconstructionSegment, cls).from_pq_workdir(workdir, segment_name, ['x'], **read_options(kwargs))
 
     def to_regression_segment(self) -> RegressionSegment:
         segment = RegressionSegment(self.segment_name)
@@ -151,16 +665,196 @@ class SegmentDataset:
     def __iter__(self):
         return self.segments.values().__iter__()
 
-    def to_pq_workdir(self, workdir):
+    def to_pq_workdir(self, workdir, max_workers=None):
+        """
+        Writes all frames of all segments concurrently.
+        :param workdir:
+        :param max_workers: the number of writer threads, or None for the executor default
+        """
+        def write(segment: Segment, frame_name):
+            path = Segment.pq_path(workdir, segment.segment_name, frame_name)
+            to_pq_frame(segment[frame_name]).to_parquet(path)
+
+        jobs = [
+            (segment, frame_name)
+            for segment in self.segments.values()
+            for frame_name in segment.frames
+        ]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Consuming the results re-raises the first failed write.
+            list(executor.map(lambda job: write(*job), jobs))
+
+    @classmethod
+    def from_pq_workdir(
+            cls,
+            workdir,
+            segment_names,
+            frame_names,
+            columns=None,
+            row_range=None,
+            nrows=None,
+            max_workers=None
+    ):
+        """
+        Reads all frames of all segments concurrently, since parquet decoding releases the GIL.
+        The segments keep the order of segment_names.
+        :param workdir:
+        :param segment_names:
+        :param frame_names:
+        :param columns: the columns to read, either for all frames or a dict by frame name
+        :param row_range: the (start, stop) range of rows to read, either for all frames or a dict by frame name
+        :param nrows: shorthand for row_range=(0, nrows)
+        :param max_workers: the number of reader threads, or None for the executor default
+        :return:
+        """
+        dataset = cls()
+        row_range = to_row_range(row_range, nrows)
+
+        def read(segment_name, frame_name):
+            return read_parquet(
+                Segment.pq_path(workdir, segment_name, frame_name),
+                columns=for_part(columns, frame_name),
+                row_range=for_part(row_range, frame_name),
+            )
+
+        jobs = [
+            (segment_name, frame_name)
+            for segment_name in segment_names
+            for frame_name in frame_names
+        ]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = executor.map(lambda job: read(*job), jobs)
+
+            for (segment_name, frame_name), frame in zip(jobs, frames):
+                if segment_name not in dataset.segments:
+                    dataset[segment_name] = Segment(segment_name)
+                dataset[segment_name][frame_name] = frame
+
+        return dataset
+
+    def to_pq_store(self, workdir, store_name='segments', row_group_size=None):
+        """
+        Writes all segments into a consolidated store: one parquet file per frame name,
+        in which every segment occupies its own row groups, and an index of the rows and row groups by segment.
+        :param workdir:
+        :param store_name:
+        :param row_group_size: the maximum number of rows of a row group, or None for the default of pyarrow
+        """
+        frame_names = []
         for segment in self.segments.values():
-            segment.to_pq_workdir(workdir)
+            frame_names += [f for f in segment.frames if f not in frame_names]
+
+        index = OrderedDict((name, {}) for name in self.segments)
+
+        # The frames are written next to the store and replace it only when all of them succeed.
+        written = []
+        try:
+            for frame_name in frame_names:
+                segments = [
+                    (n, to_pq_frame(s[frame_name])) for n, s in self.segments.items() if frame_name in s.frames
+                ]
+
+                # The index is always stored as a column,
+                # because the RangeIndex metadata only describes the first segment.
+                schema = unify_pq_schemas([pa.Schema.from_pandas(f, preserve_index=True) for n, f in segments])
+
+                path = pq_store_path(workdir, store_name, frame_name)
+                written.append(path)
+
+                ranges = []
+                offset = 0
+                with pq.ParquetWriter(f'{path}.tmp', schema) as writer:
+                    for segment_name, frame in segments:
+                        try:
+                            table = pa.Table.from_pandas(frame, schema=schema, preserve_index=True)
+                        except (pa.ArrowInvalid, pa.ArrowTypeError, KeyError) as e:
+                            raise ValueError(f'Segment {segment_name} does not match frame {frame_name}: {e}') from e
+
+                        writer.write_table(table, row_group_size=row_group_size)
+
+                        ranges.append([offset, offset + table.num_rows])
+                        offset += table.num_rows
+
+                # The writer splits large segments into several row groups.
+                row_groups = assign_row_groups(pq.read_metadata(f'{path}.tmp'), ranges)
+                for (segment_name, frame), rows, groups in zip(segments, ranges, row_groups):
+                    index[segment_name][frame_name] = {'rows': rows, 'row_groups': groups}
+        except BaseException:
+            for path in written:
+                if os.path.exists(f'{path}.tmp'):
+                    os.remove(f'{path}.tmp')
+            raise
+
+        for path in written:
+            os.replace(f'{path}.tmp', path)
+
+        index_path = f"{workdir}/{store_name}.json"
+        with open(f'{index_path}.tmp', 'w') as f:
+            f.write(json.dumps({'frames': frame_names, 'segments': index}, indent=True))
+        os.replace(f'{index_path}.tmp', index_path)
 
     @classmethod
-    def from_pq_workdir(cls, workdir, segment_names, frame_names):
+    def from_pq_store(
+            cls,
+            workdir,
+            segment_names=None,
+            frame_names=None,
+            columns=None,
+            row_range=None,
+            nrows=None,
+            store_name='segments',
+            max_workers=None
+    ):
+        """
+        Reads segments from a consolidated store.
+        Only the row groups of the requested segments are read.
+        :param workdir:
+        :param segment_names: the segments to read, or None for all segments
+        :param frame_names: the frames to read, or None for all frames
+        :param columns: the columns to read, either for all frames or a dict by frame name
+        :param row_range: the (start, stop) range of rows to read from each segment,
+        either for all frames or a dict by frame name
+        :param nrows: shorthand for row_range=(0, nrows)
+        :param store_name:
+        :param max_workers: the number of reader threads, or None for the executor default
+        :return:
+        """
+        reader = get_pq_store_reader(workdir, store_name)
+        index = reader.index
+
+        if segment_names is None:
+            segment_names = list(index['segments'])
+        if frame_names is None:
+            frame_names = index['frames']
+
         dataset = cls()
+        row_range = to_row_range(row_range, nrows)
+
+        def read(segment_name, frame_name):
+            return reader.read(
+                segment_name,
+                frame_name,
+                columns=for_part(columns, frame_name),
+                row_range=for_part(row_range, frame_name),
+            )
 
-        for name in segment_names:
-            dataset[name] = Segment.from_pq_workdir(workdir, name, frame_names)
+        jobs = [
+            (segment_name, frame_name)
+            for segment_name in segment_names
+            for frame_name in frame_names
+            if frame_name in index['segments'][segment_name]
+        ]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = executor.map(lambda job: read(*job), jobs)
+
+            for segment_name in segment_names:
+                dataset[segment_name] = Segment(segment_name)
+
+            for (segment_name, frame_name), frame in zip(jobs, frames):
+                dataset[segment_name][frame_name] = frame
 
         return dataset
 
@@ -174,6 +868,26 @@ class RegressionDataset(Dataset):
         self.test_X: Optional[pd.DataFrame] = None
         self.test_y: Optional[pd.DataFrame] = None
 
+    @classmethod
+    def stream_xy(cls, workdir, split='train', batch_size=32, file_format='pq', **kwargs):
+        """
+        Streams aligned (X, y) batches of a split, for example as the input of Keras Model.fit.
+        :param workdir:
+        :param split: one of train, validate or test
+        :param batch_size:
+        :param file_format: pq for the parquet splits, h5 for dataset.h5
+        :param kwargs: passed to stream_pq_workdir or stream_h5_workdir
+        :return:
+        """
+        splits = [f'{split}_X', f'{split}_y']
+
+        if file_format == 'pq':
+            return cls.stream_pq_workdir(workdir, splits, batch_size, **kwargs)
+        elif file_format == 'h5':
+            return cls.stream_h5_workdir(workdir, splits, batch_size, **kwargs)
+
+        raise ValueError(f'Unknown file format {file_format}')
+
 
 class FeaturesDataset(Dataset):
     def __init__(self):
@@ -209,7 +923,7 @@ class ReconstructionDataset(FeaturesDataset):
 
         dataset = RegressionDataset()
         for there, here in lookup.items():
-            dataset.__dict__[there] = self.__dict__[here]
+            self._share_split(dataset, there, here)
 
         return dataset
 
@@ -235,6 +949,6 @@ class DenoisingDataset(Dataset):
 
         dataset = RegressionDataset()
         for there, here in lookup.items():
-            dataset.__dict__[there] = self.__dict__[here]
+            self._share_split(dataset, there, here)
 
         return dataset
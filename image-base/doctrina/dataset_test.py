@@ -0,0 +1,316 @@
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+from doctrina import dataset as dataset_module
+from doctrina.dataset import (
+    PQ_HALF_FLOATS,
+    FeaturesDataset,
+    ReconstructionDataset,
+    RegressionDataset,
+    Segment,
+    SegmentDataset,
+    TargetDataset,
+)
+
+
+def make_dataset(frames_by_segment):
+    dataset = SegmentDataset()
+    for segment_name, frames in frames_by_segment.items():
+        segment = Segment(segment_name)
+        for frame_name, frame in frames.items():
+            segment[frame_name] = frame
+        dataset[segment_name] = segment
+    return dataset
+
+
+class PqStoreTest(TestCase):
+    def test_round_trip(self):
+        first = pd.DataFrame({"v": np.arange(10), "w": np.arange(10) * 0.5})
+        second = pd.DataFrame({"v": np.arange(10, 15) + 0.5, "w": np.arange(5) * 0.5}, index=np.arange(100, 105))
+        dataset = make_dataset({"a": {"x": first}, "b": {"x": second}})
+
+        with tempfile.TemporaryDirectory() as workdir:
+            dataset.to_pq_store(workdir)
+
+            b = SegmentDataset.from_pq_store(workdir, segment_names=["b"])
+            pd.testing.assert_frame_equal(second, b["b"]["x"])
+
+            a = SegmentDataset.from_pq_store(workdir, segment_names=["a"], row_range=(3, 6))
+            pd.testing.assert_frame_equal(first.iloc[3:6].astype({"v": "float64"}), a["a"]["x"])
+
+    def test_row_groups(self):
+        frames = {
+            "a": pd.DataFrame({"v": np.arange(10.0)}),
+            "b": pd.DataFrame({"v": np.arange(0.0)}),
+            "c": pd.DataFrame({"v": np.arange(5.0)}, index=np.arange(50, 55)),
+        }
+        dataset = make_dataset({name: {"x": frame} for name, frame in frames.items()})
+
+        with tempfile.TemporaryDirectory() as workdir:
+            dataset.to_pq_store(workdir, row_group_size=4)
+
+            with open(f"{workdir}/segments.json") as f:
+                index = json.loads(f.read())
+            self.assertEqual([0, 1, 2], index["segments"]["a"]["x"]["row_groups"])
+            self.assertEqual([], index["segments"]["b"]["x"]["row_groups"])
+            self.assertEqual(2, len(index["segments"]["c"]["x"]["row_groups"]))
+
+            restored = SegmentDataset.from_pq_store(workdir)
+            for name, frame in frames.items():
+                pd.testing.assert_frame_equal(frame, restored[name]["x"], check_index_type=False)
+
+            c = Segment.from_pq_store(workdir, "c", row_range=(3, None))
+            pd.testing.assert_frame_equal(frames["c"].iloc[3:], c["x"])
+
+    def test_reader_is_cached_until_the_store_is_written(self):
+        frame = pd.DataFrame({"v": np.arange(3)})
+
+        with tempfile.TemporaryDirectory() as workdir:
+            # Rewriting a store within the same mtime tick gives a store of the same size.
+            make_dataset({"a": {"x": frame}}).to_pq_store(workdir)
+            pd.testing.assert_frame_equal(frame, Segment.from_pq_store(workdir, "a")["x"])
+            make_dataset({"a": {"x": frame + 1}}).to_pq_store(workdir)
+            pd.testing.assert_frame_equal(frame + 1, Segment.from_pq_store(workdir, "a")["x"])
+
+            # Only the stores that were not modified just now are cached.
+            for name in os.listdir(workdir):
+                os.utime(f"{workdir}/{name}", (0, 0))
+            reader = dataset_module.get_pq_store_reader(workdir)
+            self.assertIs(reader, dataset_module.get_pq_store_reader(workdir))
+
+            make_dataset({"a": {"x": frame}, "b": {"x": frame + 2}}).to_pq_store(workdir)
+            self.assertIsNot(reader, dataset_module.get_pq_store_reader(workdir))
+            pd.testing.assert_frame_equal(frame + 2, Segment.from_pq_store(workdir, "b")["x"])
+
+    def test_incompatible_segments_keep_previous_store(self):
+        frame = pd.DataFrame({"v": np.arange(3)})
+
+        with tempfile.TemporaryDirectory() as workdir:
+            make_dataset({"a": {"x": frame}}).to_pq_store(workdir)
+
+            labelled = pd.DataFrame({"v": np.arange(3)}, index=["p", "q", "r"])
+            with self.assertRaises(ValueError):
+                make_dataset({"a": {"x": frame}, "b": {"x": labelled}}).to_pq_store(workdir)
+
+            self.assertEqual(["segments.json", "segments_x.parquet"], sorted(os.listdir(workdir)))
+            restored = SegmentDataset.from_pq_store(workdir)
+            self.assertEqual(["a"], list(restored.segments))
+            pd.testing.assert_frame_equal(frame, restored["a"]["x"])
+
+
+class ParallelPqWorkdirTest(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+
+        self.names = [f"s{i}" for i in range(6)]
+        self.dataset = make_dataset({
+            name: {"x": pd.DataFrame({"v": np.arange(10.0 ** (6 - i) // 100)}), "y": pd.DataFrame({"w": [i]})}
+            for i, name in enumerate(self.names)
+        })
+        self.dataset.to_pq_workdir(self.workdir, max_workers=4)
+
+    def test_matches_sequential_load(self):
+        read_parquet = dataset_module.read_parquet
+
+        def slow_read_parquet(path, **kwargs):
+            # The first segments are the largest and the slowest, so the reads finish out of order.
+            time.sleep(0.01 * (6 - int(os.path.basename(path)[1])))
+            return read_parquet(path, **kwargs)
+
+        with mock.patch.object(dataset_module, "read_parquet", side_effect=slow_read_parquet):
+            loaded = SegmentDataset.from_pq_workdir(self.workdir, self.names, ["x", "y"], max_workers=6)
+
+        self.assertEqual(self.names, list(loaded.segments))
+        for name in self.names:
+            sequential = Segment.from_pq_workdir(self.workdir, name, ["x", "y"])
+            self.assertEqual(["x", "y"], list(loaded[name].frames))
+            for frame_name in ["x", "y"]:
+                pd.testing.assert_frame_equal(sequential[frame_name], loaded[name][frame_name])
+                pd.testing.assert_frame_equal(self.dataset[name][frame_name], loaded[name][frame_name])
+
+    def test_failed_read_is_raised(self):
+        os.remove(Segment.pq_path(self.workdir, "s3", "y"))
+
+        with self.assertRaises(FileNotFoundError):
+            SegmentDataset.from_pq_workdir(self.workdir, self.names, ["x", "y"], max_workers=4)
+
+
+class H5WorkdirTest(TestCase):
+    def test_datasets_share_the_file(self):
+        features = FeaturesDataset()
+        targets = TargetDataset()
+        for split in ["train", "validate", "test"]:
+            setattr(features, f"{split}_X", pd.DataFrame({"a": np.arange(5.0)}))
+            setattr(targets, f"{split}_y", pd.DataFrame({"y": np.arange(5)}))
+
+        with tempfile.TemporaryDirectory() as workdir:
+            features.to_h5_workdir(workdir)
+            report = targets.to_h5_workdir(workdir)
+            self.assertEqual(os.path.getsize(f"{workdir}/dataset.h5"), report["file_bytes"])
+
+            dataset = RegressionDataset.from_h5_workdir(workdir)
+            pd.testing.assert_frame_equal(features.test_X, dataset.test_X)
+            pd.testing.assert_frame_equal(targets.train_y, dataset.train_y)
+
+            targets.to_h5_workdir(workdir, replace=True)
+            with self.assertRaises(KeyError):
+                RegressionDataset.from_h5_workdir(workdir)
+
+
+class HalfFloatTest(TestCase):
+    def test_compacted_frames_round_trip(self):
+        frame = pd.DataFrame({"a": np.linspace(0, 1, 9), "b": np.arange(9)})
+        features = FeaturesDataset()
+        for split in ["train", "validate", "test"]:
+            setattr(features, f"{split}_X", frame)
+        features.compact(float_dtype="float16")
+        segments = make_dataset({"s": {"x": features.train_X}})
+
+        for half_floats in [False, True]:
+            with self.subTest(half_floats=half_floats), tempfile.TemporaryDirectory() as workdir, \
+                    mock.patch.object(dataset_module, "PQ_HALF_FLOATS", half_floats):
+                if half_floats and not PQ_HALF_FLOATS:
+                    self.skipTest("pyarrow before 15 cannot write float16 to parquet")
+
+                features.to_pq_workdir(workdir)
+                segments.to_pq_store(workdir)
+
+                expected = features.train_X if half_floats else features.train_X.astype({"a": "float32"})
+                pd.testing.assert_frame_equal(expected, FeaturesDataset.from_pq_workdir(workdir).train_X)
+                pd.testing.assert_frame_equal(
+                    expected, SegmentDataset.from_pq_store(workdir)["s"]["x"], check_index_type=False
+                )
+
+
+class StreamWorkdirTest(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+
+        # y is 10 times the row of X, so that misaligned batches are detected.
+        self.dataset = RegressionDataset()
+        for split in ["train", "validate", "test"]:
+            setattr(self.dataset, f"{split}_X", pd.DataFrame({"a": np.arange(23.0), "b": np.arange(23)}))
+            setattr(self.dataset, f"{split}_y", pd.DataFrame({"y": np.arange(23) * 10}))
+        self.dataset.to_pq_workdir(self.workdir)
+        self.dataset.to_h5_workdir(self.workdir)
+
+    def test_stream_xy(self):
+        for file_format in ["pq", "h5"]:
+            for shuffle_buffer in [None, 8]:
+                with self.subTest(file_format=file_format, shuffle_buffer=shuffle_buffer):
+                    batches = list(RegressionDataset.stream_xy(
+                        self.workdir, batch_size=5, file_format=file_format, shuffle_buffer=shuffle_buffer, seed=0
+                    ))
+
+                    self.assertEqual([5, 5, 5, 5, 3], [x.shape[0] for x, y in batches])
+                    for x, y in batches:
+                        self.assertEqual((x["b"] * 10).tolist(), y["y"].tolist())
+
+                    streamed = pd.concat([x for x, y in batches])
+                    self.assertEqual(shuffle_buffer is None, streamed["b"].tolist() == list(range(23)))
+                    pd.testing.assert_frame_equal(
+                        self.dataset.train_X, streamed.sort_values("b"), check_index_type=False
+                    )
+
+    def test_stream_workdir_as_numpy(self):
+        batches = list(FeaturesDataset.stream_pq_workdir(
+            self.workdir, ["validate_X"], batch_size=10, columns=["a"], as_numpy=True
+        ))
+        self.assertEqual([(10, 1), (10, 1), (3, 1)], [x.shape for x, in batches])
+        np.testing.assert_array_equal(np.arange(23.0), np.concatenate(batches, axis=None))
+
+        batches = list(RegressionDataset.stream_h5_workdir(
+            self.workdir, ["test_X", "test_y"], batch_size=10, shuffle_buffer=10, seed=1, as_numpy=True
+        ))
+        x = np.concatenate([x for x, y in batches])
+        y = np.concatenate([y for x, y in batches])
+        np.testing.assert_array_equal(x[:, 1] * 10, y[:, 0])
+        self.assertEqual(list(range(23)), sorted(x[:, 1]))
+
+    def test_unknown_file_format(self):
+        with self.assertRaises(ValueError):
+            RegressionDataset.stream_xy(self.workdir, file_format="csv")
+
+
+class LazyDatasetTest(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+
+        self.features = FeaturesDataset()
+        for i, split in enumerate(["train", "validate", "test"]):
+            setattr(self.features, f"{split}_X", pd.DataFrame({"a": np.arange(5.0) + i, "b": np.arange(5)}))
+        self.features.to_pq_workdir(self.workdir)
+
+    def test_lazy_load(self):
+        dataset = FeaturesDataset.from_pq_workdir(self.workdir, lazy=True)
+        self.assertEqual(["train_X", "validate_X", "test_X"], dataset.splits())
+        self.assertFalse(dataset.is_loaded("train_X"))
+
+        pd.testing.assert_frame_equal(self.features.train_X, dataset.train_X)
+        self.assertTrue(dataset.is_loaded("train_X"))
+        self.assertFalse(dataset.is_loaded("test_X"))
+
+    def test_release(self):
+        lazy = FeaturesDataset.from_pq_workdir(self.workdir, lazy=True)
+        lazy.train_X
+        lazy.release("train_X")
+        self.assertFalse(lazy.is_loaded("train_X"))
+        pd.testing.assert_frame_equal(self.features.train_X, lazy.train_X)
+
+        eager = FeaturesDataset.from_pq_workdir(self.workdir)
+        eager.release()
+        self.assertIsNone(eager.train_X)
+        self.assertIsNone(eager.test_X)
+
+    def test_regression_dataset_keeps_splits_lazy(self):
+        dataset = ReconstructionDataset.from_pq_workdir(self.workdir, lazy=True)
+        dataset.train_X
+
+        regression = dataset.to_regression_dataset()
+        self.assertTrue(regression.is_loaded("train_y"))
+        self.assertIs(dataset.train_X, regression.train_X)
+        self.assertFalse(regression.is_loaded("test_y"))
+        self.assertFalse(regression.is_loaded("test_X"))
+
+        pd.testing.assert_frame_equal(self.features.test_X, regression.test_y)
+        self.assertFalse(dataset.is_loaded("test_X"))
+
+
+class ProjectionTest(TestCase):
+    def test_row_groups_and_stepped_index(self):
+        frame = pd.DataFrame(
+            {"a": np.arange(10.0), "b": np.arange(10)},
+            index=pd.RangeIndex(100, 120, 2, name="row"),
+        )
+
+        with tempfile.TemporaryDirectory() as workdir:
+            frame.to_parquet(f"{workdir}/s_x.parquet", row_group_size=4)
+            for split in ["train", "validate", "test"]:
+                frame.to_parquet(f"{workdir}/{split}_X.parquet", row_group_size=4)
+
+            segment = Segment.from_pq_workdir(workdir, "s", ["x"], columns=["b"], row_range=(3, 9))
+            pd.testing.assert_frame_equal(frame.iloc[3:9][["b"]], segment["x"])
+            pd.testing.assert_index_equal(pd.RangeIndex(106, 118, 2, name="row"), segment["x"].index, exact=True)
+
+            dataset = FeaturesDataset.from_pq_workdir(
+                workdir, columns={"train_X": ["a"]}, row_range={"validate_X": (5, None)}, lazy=True
+            )
+            pd.testing.assert_frame_equal(frame[["a"]], dataset.train_X)
+            pd.testing.assert_frame_equal(frame.iloc[5:], dataset.validate_X)
+            self.assertIsInstance(dataset.validate_X.index, pd.RangeIndex)
+            pd.testing.assert_frame_equal(frame, dataset.test_X)
+
+            head = FeaturesDataset.from_pq_workdir(workdir, nrows=6)
+            pd.testing.assert_frame_equal(frame.iloc[:6], head.test_X)
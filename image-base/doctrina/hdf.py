@@ -0,0 +1,58 @@
+import os
+import time
+
+from doctrina.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+
+def write_h5(path, frames: dict, format='fixed', complib='blosc:zstd', complevel=5, mode='a') -> dict:
+    """
+    Writes several frames into an HDF file, opening the file only once.
+    :param path:
+    :param frames: the frames (or series) to write by key
+    :param format: fixed for the fastest full reads, table for queries and categoricals
+    :param complib: the compression library, or None to disable compression
+    :param complevel: from 0 (no compression) to 9
+    :param mode: a to keep the other keys of an existing file, w to replace the file
+    :return: the written keys, bytes and seconds, where bytes is the growth of the file,
+    which rewritten keys may not change at all with mode a, and file_bytes is the size of the file
+    """
+    bytes_before = os.path.getsize(path) if mode == 'a' and os.path.exists(path) else 0
+    start = time.perf_counter()
+
+    with pd.HDFStore(path, mode=mode, complib=complib, complevel=complevel) as store:
+        for key, frame in frames.items():
+            frame_format = 'table' if has_categories(frame) else format
+            store.put(key, frame, format=frame_format)
+
+    file_bytes = os.path.getsize(path)
+    report = {
+        'path': path,
+        'keys': list(frames),
+        'bytes': file_bytes - bytes_before,
+        'file_bytes': file_bytes,
+        'seconds': time.perf_counter() - start,
+    }
+
+    print(f"Wrote {report['bytes']} bytes to {path} in {report['seconds']:.2f}s")
+    return report
+
+
+def has_categories(frame) -> bool:
+    """
+    The fixed format cannot store categoricals, so such frames are written in the table format.
+    """
+    dtypes = [frame.dtype] if isinstance(frame, pd.Series) else frame.dtypes
+    return any(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes)
+
+
+def read_h5(path, keys) -> dict:
+    """
+    Reads several frames from an HDF file, opening the file only once.
+    :param path:
+    :param keys:
+    :return: the frames by key
+    """
+    with pd.HDFStore(path, mode='r') as store:
+        return {key: store.get(key) for key in keys}
@@ -1,26 +1,27 @@
+from __future__ import annotations
+
+import copy
+import itertools
+import math
 import os
-from collections import OrderedDict
+from typing import Optional
 
-import pandas as pd
+from doctrina.lazy import lazy_import
+from doctrina.learning_curve import LearningCurve
+from doctrina.pipeline import get_worker_pool, wait_fitting
+from doctrina.resources import ResourcePool
+from doctrina.task import get_task_index
+from doctrina.tree import explode_tree, merge_tree
 
-from doctrina.task import load_task, get_job_path
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 def find_experiments(workspace: str, job_name: str) -> dict:
-
-    job_space = get_job_path(workspace, job_name)
-    job_ids = os.listdir(job_space)
-
-    workdirs = [job_space + '/' + job_id for job_id in job_ids]
-    tasks = [load_task(workdir) for workdir in workdirs]
+    index = get_task_index(workspace)
 
     experiments = {}
-    for workdir, task in zip(workdirs, tasks):
-        if 'experiment' not in task:
-            continue
-        if not os.path.exists(f'{workdir}/closing.time'):
-            continue
-
+    for workdir, task in index.find(job=job_name, closed=True, with_experiment=True):
         experiment = task['experiment']
         if experiment not in experiments:
             experiments[experiment] = []
@@ -53,18 +54,360 @@ def summarize_task_property(tasks: list, path: list) -> object:
     return summary
 
 
+# The value of a path that a task does not have.
+MISSING = object()
+
+
+def summarize_tasks(tasks: list, properties: list) -> list:
+    """
+    Summarizes several properties like summarize_task_property, walking each task only once.
+    The steps shared by several paths, such as model in ['model', 'units'] and ['model', 'layers'],
+    are taken once per task.
+    :param tasks:
+    :param properties: the paths of the properties, such as ['model', 'units']
+    :return: the summary of each property
+    """
+    # Every prefix of the paths is a node, which is reached by one step from the node of its parent prefix.
+    nodes = {(): 0}
+    steps = []
+    for path in properties:
+        for i in range(len(path)):
+            prefix = tuple(path[:i + 1])
+            if prefix not in nodes:
+                nodes[prefix] = len(steps) + 1
+                steps.append((nodes[prefix[:-1]], path[i]))
+
+    ends = [nodes[tuple(path)] for path in properties]
+    has_summary = [False] * len(properties)
+    summaries = [None] * len(properties)
+
+    for task in tasks:
+        values = [task]
+        for parent, step in steps:
+            current = values[parent]
+            values.append(current[step] if current is not MISSING and step in current else MISSING)
+
+        for i, node in enumerate(ends):
+            value = values[node]
+            if value is MISSING:
+                continue
+
+            if not has_summary[i]:
+                summaries[i] = value
+                has_summary[i] = True
+            elif summaries[i] != value:
+                summaries[i] = 'Varies'
+
+    return summaries
+
+
 def summarize_experiments(experiments: dict, properties: list):
-    experiments = OrderedDict(experiments)
+    """
+    :param experiments: the tasks by experiment name
+    :param properties: the paths of the properties to summarize, such as ['model', 'units']
+    :return: a row per experiment with its number of tasks and the value of each property,
+    Varies if the tasks differ or None if no task has it
+    """
+    names = list(experiments)
+    summaries = [summarize_tasks(experiments[name], properties) for name in names]
 
     experiments_report = pd.DataFrame()
-    experiments_report['name'] = [name for name, tasks in experiments.items()]
-    experiments_report['tasks'] = [len(tasks) for name, tasks in experiments.items()]
+    experiments_report['name'] = names
+    experiments_report['tasks'] = [len(experiments[name]) for name in names]
 
-    for prop in properties:
-        experiments_report[prop[-1]] = [
-            summarize_task_property(tasks, prop)
-            for name, tasks in experiments.items()
-        ]
+    for i, prop in enumerate(properties):
+        experiments_report[prop[-1]] = [summary[i] for summary in summaries]
 
     experiments_report = experiments_report.sort_values('name').reset_index(drop=True)
     return experiments_report
+
+
+class Uniform:
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng):
+        return float(rng.uniform(self.low, self.high))
+
+
+class LogUniform(Uniform):
+    def sample(self, rng):
+        return float(math.exp(rng.uniform(math.log(self.low), math.log(self.high))))
+
+
+class IntUniform(Uniform):
+    def sample(self, rng):
+        # Both bounds are included.
+        return int(rng.integers(self.low, self.high + 1))
+
+
+def grid_space(space: dict) -> list:
+    """
+    :param space: the lists of values by parameter path, such as {'model/units': [32, 64]}
+    :return: the parameters of every combination of the values
+    """
+    paths = list(space)
+    return [dict(zip(paths, values)) for values in itertools.product(*[space[p] for p in paths])]
+
+
+def random_space(space: dict, n, seed=None) -> list:
+    """
+    :param space: the lists of values or the distributions (such as Uniform) by parameter path
+    :param n: the number of samples
+    :param seed:
+    :return: the parameters of the samples
+    """
+    rng = np.random.default_rng(seed)
+
+    def sample(values):
+        if isinstance(values, Uniform):
+            return values.sample(rng)
+        return values[int(rng.integers(len(values)))]
+
+    return [{path: sample(values) for path, values in space.items()} for _ in range(n)]
+
+
+def make_trial(task: dict, params: dict, experiment, search: dict) -> dict:
+    """
+    :param task: the task that every trial starts from
+    :param params: the values by parameter path, separated by /
+    :param experiment: the experiment that groups the trials, see find_experiments
+    :param search: the position of the trial in the search, saved in task['search']
+    :return:
+    """
+    trial = merge_tree(copy.deepcopy(task), explode_tree(params, separator='/'))
+    trial['experiment'] = experiment
+    trial['search'] = search
+    return trial
+
+
+def execute_trials(trials: list, parallel_processes=1) -> list:
+    """
+    Executes the trials on the worker pool of the pipelines, within the resources they declare.
+    :param trials:
+    :param parallel_processes:
+    :return: the executed trials, with None for the failed ones
+    """
+    settings = {'parallel_processes': parallel_processes}
+    executor = get_worker_pool(settings)
+    pool = ResourcePool.from_task(settings)
+
+    for trial in trials:
+        pool.check(trial)
+
+    queued = list(enumerate(trials))
+    running = {}
+    executed = [None] * len(trials)
+
+    while len(queued) + len(running) > 0:
+        for i, trial, future in wait_fitting(executor, pool, queued, running):
+            if future.exception() is not None:
+                print(f"Trial {trial['search']['trial']} failed: {future.exception()}")
+                continue
+
+            executed[i] = future.result()
+
+    return executed
+
+
+def get_trial_score(workdir, metric=None, mode='min') -> Optional[float]:
+    """
+    :param workdir: the workdir of an executed trial, with its learning curve
+    :param metric: the name of the metric, by default the loss
+    :param mode: min or max, whichever is better
+    :return: the best validation score over the epochs, or None without a learning curve
+    """
+    if not os.path.exists(f'{workdir}/learning_curve.h5'):
+        return None
+
+    scores = LearningCurve.from_workdir(workdir).learning_scores
+    metric = scores.columns[0][0] if metric is None else metric
+
+    validate = scores[(metric, 'validate')].astype(float)
+    score = validate.min() if mode == 'min' else validate.max()
+
+    return None if math.isnan(score) else float(score)
+
+
+def run_rung(task: dict, survivors: list, experiment, search: dict, metric, mode, parallel_processes) -> list:
+    """
+    :param task: the task that every trial starts from
+    :param survivors: the (trial id, parameters) to execute
+    :param experiment:
+    :param search: the position of the trials in the search, saved in task['search'] and in the results
+    :param metric:
+    :param mode:
+    :param parallel_processes:
+    :return: the result of every trial
+    """
+    trials = [make_trial(task, params, experiment, dict(search, trial=trial_id)) for trial_id, params in survivors]
+
+    results = []
+    for (trial_id, params), trial in zip(survivors, execute_trials(trials, parallel_processes)):
+        workdir = None if trial is None else trial['workdir']
+        score = None if trial is None else get_trial_score(workdir, metric, mode)
+        results.append(dict(search, trial=trial_id, score=score, workdir=workdir, **params))
+
+    return results
+
+
+def halve_trials(
+        task: dict,
+        configs: list,
+        experiment,
+        search: dict,
+        min_budget,
+        max_budget,
+        budget_path,
+        eta,
+        metric,
+        mode,
+        parallel_processes,
+) -> list:
+    """
+    Successive halving: executes the configurations with the budget,
+    then repeats with the best 1/eta of them and eta times the budget, up to max_budget.
+    Trials are ranked by their learning curves, so the poor ones are stopped after the small budgets.
+    :return: the result of every executed trial
+    """
+    survivors = list(enumerate(configs))
+    budget = min_budget
+    rung = 0
+    results = []
+
+    while True:
+        rung_results = run_rung(
+            task,
+            [(trial_id, {**params, budget_path: budget}) for trial_id, params in survivors],
+            experiment,
+            dict(search, rung=rung, budget=budget),
+            metric,
+            mode,
+            parallel_processes,
+        )
+        results += rung_results
+
+        keep = len(survivors) // eta
+        if budget >= max_budget or keep == 0:
+            return results
+
+        scored = [(r['score'], trial_id, params) for r, (trial_id, params) in zip(rung_results, survivors)]
+        scored = sorted([s for s in scored if s[0] is not None], key=lambda s: s[0], reverse=mode == 'max')
+
+        survivors = [(trial_id, params) for score, trial_id, params in scored[:keep]]
+        budget = min(budget * eta, max_budget)
+        rung += 1
+
+
+def to_search_report(results: list, mode) -> pd.DataFrame:
+    """
+    :param results: the results of the trials, which may be empty, such as for an empty grid
+    :param mode:
+    :return: the results, best first, with at least the trial, score and workdir columns
+    """
+    report = pd.DataFrame(results, columns=None if len(results) > 0 else ['trial', 'score', 'workdir'])
+    return report.sort_values('score', ascending=mode == 'min', na_position='last').reset_index(drop=True)
+
+
+def grid_search(task: dict, space: dict, experiment, metric=None, mode='min', parallel_processes=1) -> pd.DataFrame:
+    """
+    :param task: the task that every trial starts from
+    :param space: the lists of values by parameter path, separated by /
+    :param experiment: the experiment that groups the trials, see find_experiments
+    :param metric: the metric of the learning curve to rank by, by default the loss
+    :param mode: min or max, whichever is better
+    :param parallel_processes: the number of trials executed at the same time
+    :return: the results of the trials, best first
+    """
+    search = {'name': experiment, 'method': 'grid'}
+    configs = list(enumerate(grid_space(space)))
+    return to_search_report(run_rung(task, configs, experiment, search, metric, mode, parallel_processes), mode)
+
+
+def random_search(
+        task: dict,
+        space: dict,
+        experiment,
+        n,
+        seed=None,
+        metric=None,
+        mode='min',
+        parallel_processes=1,
+) -> pd.DataFrame:
+    """
+    :param space: the lists of values or the distributions by parameter path, separated by /
+    :param n: the number of trials
+    :param seed:
+    :return: the results of the trials, best first
+    """
+    search = {'name': experiment, 'method': 'random'}
+    configs = list(enumerate(random_space(space, n, seed)))
+    return to_search_report(run_rung(task, configs, experiment, search, metric, mode, parallel_processes), mode)
+
+
+def successive_halving(
+        task: dict,
+        space: dict,
+        experiment,
+        n,
+        min_budget,
+        max_budget,
+        budget_path='epochs',
+        eta=3,
+        seed=None,
+        metric=None,
+        mode='min',
+        parallel_processes=1,
+) -> pd.DataFrame:
+    """
+    :param n: the number of sampled configurations
+    :param min_budget: the budget of the first rung, such as the number of epochs
+    :param max_budget: the budget of the last rung
+    :param budget_path: the path of the budget parameter of the task, separated by /
+    :param eta: the factor by which each rung reduces the trials and increases the budget
+    :return: the results of the trials in every rung, best first
+    """
+    search = {'name': experiment, 'method': 'successive_halving'}
+    configs = random_space(space, n, seed)
+
+    results = halve_trials(
+        task, configs, experiment, search, min_budget, max_budget, budget_path, eta, metric, mode, parallel_processes
+    )
+    return to_search_report(results, mode)
+
+
+def hyperband(
+        task: dict,
+        space: dict,
+        experiment,
+        min_budget,
+        max_budget,
+        budget_path='epochs',
+        eta=3,
+        seed=None,
+        metric=None,
+        mode='min',
+        parallel_processes=1,
+) -> pd.DataFrame:
+    """
+    Runs successive halving in brackets that trade the number of configurations for their first budget,
+    from many configurations with min_budget to few configurations with max_budget.
+    :return: the results of the trials in every bracket and rung, best first
+    """
+    s_max = int(math.floor(math.log(max_budget / min_budget, eta) + 1e-9))
+    rng = np.random.default_rng(seed)
+    results = []
+
+    for bracket in range(s_max, -1, -1):
+        n = int(math.ceil((s_max + 1) / (bracket + 1) * eta ** bracket))
+        budget = max(min_budget, int(round(max_budget / eta ** bracket)))
+
+        search = {'name': experiment, 'method': 'hyperband', 'bracket': bracket}
+        configs = random_space(space, n, rng)
+
+        results += halve_trials(
+            task, configs, experiment, search, budget, max_budget, budget_path, eta, metric, mode, parallel_processes
+        )
+
+    return to_search_report(results, mode)
@@ -0,0 +1,127 @@
+import math
+from unittest import TestCase, mock
+
+from doctrina import hypersearch
+from doctrina.hypersearch import (
+    IntUniform,
+    grid_space,
+    halve_trials,
+    make_trial,
+    random_space,
+    summarize_experiments,
+    summarize_task_property,
+    summarize_tasks,
+)
+
+
+class SearchSpaceTest(TestCase):
+    def test_grid_space(self):
+        configs = grid_space({"model/units": [32, 64], "lr": [0.1, 0.01, 0.001]})
+        self.assertEqual(6, len(configs))
+        self.assertIn({"model/units": 64, "lr": 0.01}, configs)
+
+    def test_random_space_is_seeded(self):
+        space = {"model/units": [32, 64], "layers": IntUniform(1, 3)}
+        self.assertEqual(random_space(space, 5, seed=1), random_space(space, 5, seed=1))
+        self.assertTrue(all(1 <= c["layers"] <= 3 for c in random_space(space, 20, seed=2)))
+
+    def test_empty_search(self):
+        report = hypersearch.grid_search({}, {"lr": []}, "search")
+        self.assertEqual(0, report.shape[0])
+        self.assertIn("score", report.columns)
+
+        report = hypersearch.random_search({}, {"lr": [0.1]}, "search", n=0)
+        self.assertEqual(0, report.shape[0])
+
+    def test_make_trial_keeps_task(self):
+        task = {"model": {"units": 8, "activation": "relu"}, "epochs": 10}
+        trial = make_trial(task, {"model/units": 64}, "search", {"trial": 0})
+        self.assertEqual({"units": 64, "activation": "relu"}, trial["model"])
+        self.assertEqual(8, task["model"]["units"])
+        self.assertEqual("search", trial["experiment"])
+
+
+class SummarizeExperimentsTest(TestCase):
+    def test_summary(self):
+        experiments = {
+            "b": [{"model": {"units": 8, "layers": [1, 2]}}, {"model": {"units": 16, "layers": [1, 2]}}],
+            "a": [{"model": {"units": 8}, "lr": None}],
+        }
+        report = summarize_experiments(experiments, [["model", "units"], ["model", "layers"], ["lr"], ["model"]])
+
+        self.assertEqual(["a", "b"], report["name"].tolist())
+        self.assertEqual([1, 2], report["tasks"].tolist())
+        self.assertEqual([8, "Varies"], report["units"].tolist())
+        self.assertEqual([None, [1, 2]], report["layers"].tolist())
+        self.assertEqual([None, None], report["lr"].tolist())
+        self.assertEqual("Varies", report["model"][1])
+
+    def test_values_and_subtrees(self):
+        experiments = {"a": [{"opt": "adam"}, {"opt": {"name": "sgd"}}], "b": [{"opt": "adam"}]}
+        report = summarize_experiments(experiments, [["opt"], ["opt", "name"]])
+
+        self.assertEqual(["Varies", "adam"], report["opt"].tolist())
+        self.assertEqual("sgd", report["name"][0])
+
+    def test_nan(self):
+        experiments = {"a": [{"lr": math.nan}, {"lr": math.nan}], "b": [{"lr": math.nan}], "c": [{"lr": 0.1}, {}]}
+        report = summarize_experiments(experiments, [["lr"]])
+
+        self.assertEqual("Varies", report["lr"][0])
+        self.assertTrue(math.isnan(report["lr"][1]))
+        self.assertEqual(0.1, report["lr"][2])
+
+    def test_single_pass_matches_each_property(self):
+        tasks = [
+            {"model": {"units": 8, "layers": [1, 2], "opt": {"name": "adam"}}, "lr": 0.1},
+            {"model": {"units": 8, "layers": [1, 3], "opt": "sgd"}, "lr": 0.1},
+            {"model": {"units": 8}, "epochs": 5},
+        ]
+        properties = [
+            ["model", "units"], ["model", "layers"], ["model", "opt"], ["model", "opt", "name"],
+            ["model"], ["lr"], ["epochs"], ["missing", "path"], ["lr"],
+        ]
+
+        self.assertEqual(
+            [summarize_task_property(tasks, prop) for prop in properties],
+            summarize_tasks(tasks, properties),
+        )
+
+
+class HalveTrialsTest(TestCase):
+    def halve(self, scores, failed=(), mode="min"):
+        """
+        :param scores: the score of each trial id, missing for the trials without a learning curve
+        :param failed: the ids of the trials that fail
+        :return: the (rung, budget, trial) of every executed trial
+        """
+
+        def execute_trials(trials, parallel_processes):
+            return [
+                None if t["search"]["trial"] in failed else {"workdir": f"{t['search']['trial']}/{t['epochs']}"}
+                for t in trials
+            ]
+
+        def get_trial_score(workdir, metric, mode):
+            return scores.get(int(workdir.split("/")[0]))
+
+        with mock.patch.object(hypersearch, "execute_trials", side_effect=execute_trials), \
+                mock.patch.object(hypersearch, "get_trial_score", side_effect=get_trial_score):
+            results = halve_trials(
+                {"epochs": 0}, [{"lr": i} for i in range(9)], "search", {"name": "search"},
+                1, 9, "epochs", 3, None, mode, 1,
+            )
+
+        return [(r["rung"], r["budget"], r["trial"]) for r in results]
+
+    def test_rungs(self):
+        results = self.halve({i: float(i) for i in range(9)})
+        self.assertEqual([(0, 1, i) for i in range(9)] + [(1, 3, 0), (1, 3, 1), (1, 3, 2), (2, 9, 0)], results)
+
+    def test_unscored_and_failed_trials_are_dropped(self):
+        results = self.halve({i: float(i) for i in range(1, 9) if i != 1}, failed={0})
+        self.assertEqual([(1, 3, 2), (1, 3, 3), (1, 3, 4), (2, 9, 2)], results[9:])
+
+    def test_max_mode(self):
+        results = self.halve({i: float(i) for i in range(9)}, mode="max")
+        self.assertEqual([(1, 3, 8), (1, 3, 7), (1, 3, 6), (2, 9, 8)], results[9:])
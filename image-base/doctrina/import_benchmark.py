@@ -0,0 +1,91 @@
+"""
+Reports the import time of the doctrina modules, as measured by `python -X importtime`.
+Run with `python -m doctrina.import_benchmark [modules...]` from the parent directory of the package.
+"""
+import os
+import subprocess
+import sys
+
+MODULES = [
+    'doctrina.tree',
+    'doctrina.task',
+    'doctrina.pipeline',
+    'doctrina.hypersearch',
+    'doctrina.util',
+    'doctrina.learning_curve',
+    'doctrina.dataset',
+]
+
+# The dependencies that only the modules working with them should import.
+HEAVY_MODULES = [
+    'boto3',
+    'joblib',
+    'matplotlib',
+    'mlflow',
+    'numpy',
+    'pandas',
+    'pyarrow',
+    'requests',
+    'sklearn',
+    'tensorflow',
+]
+
+
+def get_package_root():
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(module) -> list:
+    """
+    :param module:
+    :return: the (cumulative microseconds, name) of every module imported by importing the module
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=get_package_root(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), name.strip()))
+
+    return imports
+
+
+def find_heavy_imports(module) -> list:
+    """
+    :param module:
+    :return: the heavy dependencies that are imported by importing the module
+    """
+    code = f'import sys, {module}; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=get_package_root(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return [m for m in result.stdout.strip().split(',') if m != '']
+
+
+def report(modules, top=10):
+    for module in modules:
+        imports = measure_import(module)
+        total = next(us for us, name in imports if name == module)
+
+        print(f'{module}: {total / 1000:.1f} ms')
+        dependencies = [(us, name) for us, name in imports if name != module]
+        for us, name in sorted(dependencies, reverse=True)[:top]:
+            print(f'    {us / 1000:8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    report(sys.argv[1:] or MODULES)
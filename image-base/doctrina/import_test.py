@@ -0,0 +1,19 @@
+from unittest import TestCase
+
+from doctrina.import_benchmark import find_heavy_imports
+
+# The modules that must stay cheap to import, for tasks that only need to load other tasks.
+LIGHT_MODULES = [
+    "doctrina.tree",
+    "doctrina.task",
+    "doctrina.pipeline",
+    "doctrina.hypersearch",
+    "doctrina.util",
+    "doctrina.learning_curve",
+]
+
+
+class LazyImportTest(TestCase):
+    def test_light_modules_import_no_heavy_dependencies(self):
+        for module in LIGHT_MODULES:
+            self.assertEqual([], find_heavy_imports(module), module)
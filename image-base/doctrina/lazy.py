@@ -0,0 +1,32 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    A module that is imported on the first access to any of its attributes.
+    Modules that use it in annotations need `from __future__ import annotations`.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, item):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+
+        return getattr(module, item)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+def lazy_import(name) -> types.ModuleType:
+    """
+    :param name: the full name of the module, such as matplotlib.pyplot
+    :return: a module that is imported on the first use
+    """
+    return LazyModule(name)
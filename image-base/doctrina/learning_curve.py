@@ -1,15 +1,21 @@
+from __future__ import annotations
+
 import io
 import math
-from typing import Optional
-
-import matplotlib.pyplot as plt
-import mlflow
-import pandas as pd
-from matplotlib.figure import Figure
-from tensorflow.python.keras import Sequential
+from typing import TYPE_CHECKING, Optional
 
+from doctrina.lazy import lazy_import
+from doctrina.tracking import log_batch, to_metrics
 from doctrina.util import save_public_s3
-from doctrina.dataset import Dataset, SegmentDataset
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+    from tensorflow.python.keras import Sequential
+
+    from doctrina.dataset import Dataset, SegmentDataset
+
+plt = lazy_import('matplotlib.pyplot')
+pd = lazy_import('pandas')
 
 
 class LearningCurve:
@@ -144,8 +150,17 @@ class LearningCurve:
         return curve
 
     def to_mlflow(self):
-        metrics = {'/'.join(k): v for k, v in self.final_scores.iloc[0].to_dict().items()}
-        mlflow.log_metrics(metrics)
+        """
+        Logs the final scores, and the scores of every epoch as the steps of learning/{metric}/{split}.
+        """
+        final_scores = {'/'.join(k): v for k, v in self.final_scores.iloc[0].to_dict().items()}
+        metrics = to_metrics(final_scores)
+
+        for epoch, scores in self.learning_scores.iterrows():
+            learning_scores = {'learning/' + '/'.join(k): v for k, v in scores.to_dict().items()}
+            metrics += to_metrics(learning_scores, step=int(epoch))
+
+        log_batch(metrics=metrics)
 
     def to_workdir(self, workdir):
         path = f'{workdir}/learning_curve.h5'
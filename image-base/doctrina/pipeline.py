@@ -1,11 +1,102 @@
 import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Optional
 
-from joblib import Parallel, delayed
+from doctrina.lazy import lazy_import
+from doctrina.resources import ResourcePool, limit_threads
+from doctrina.task import execute, preload_modules
+from doctrina.telemetry import aggregate_telemetry, load_telemetry, save_telemetry
 
-from doctrina.task import execute
+loky = lazy_import('joblib.externals.loky')
+
+# Workers are kept alive between stages and pipelines for this long.
+WORKER_IDLE_TIMEOUT = 3600
+
+
+def get_default_preload_modules() -> tuple:
+    modules = os.getenv('APP_PRELOAD_MODULES', '')
+    return tuple(m.strip() for m in modules.split(',') if m.strip() != '')
+
+
+def get_worker_pool(task: dict):
+    """
+    Returns the process pool of this process, which is reused between stages and pipelines
+    as long as the number of processes and the preloaded modules stay the same.
+    Each worker imports task['preload_modules'] (by default $APP_PRELOAD_MODULES) once when it starts,
+    and keeps the modules and the resolved task functions for the next tasks.
+    :param task: the pipeline task
+    :return:
+    """
+    modules = tuple(task.get('preload_modules', get_default_preload_modules()))
+
+    return loky.get_reusable_executor(
+        max_workers=task.get('parallel_processes', 1),
+        timeout=WORKER_IDLE_TIMEOUT,
+        initializer=preload_modules,
+        initargs=(modules,),
+    )
+
+
+def execute_with_limits(task: dict, cpus) -> dict:
+    limit_threads(cpus)
+    return execute(task)
+
+
+def submit_fitting(executor, pool: ResourcePool, queued: list, running: dict):
+    """
+    Submits the queued tasks whose declared resources are free, in the order of the queue,
+    so that a smaller task may start before a larger one that waits for resources.
+    At most pool.processes tasks run at once, since further tasks would wait in the executor
+    while holding their resources.
+    :param executor:
+    :param pool: the free resources, updated with the submitted tasks
+    :param queued: the (key, task) pairs to submit, updated with the tasks that are still queued
+    :param running: updated with the submitted (key, task) pairs by future
+    """
+    for key, t in list(queued):
+        if len(running) >= pool.processes:
+            return
+
+        if not pool.fits(t):
+            continue
+
+        queued.remove((key, t))
+        pool.acquire(t)
+        running[executor.submit(execute_with_limits, t, pool.get_cpus(t))] = (key, t)
+
+
+def wait_fitting(executor, pool: ResourcePool, queued: list, running: dict) -> list:
+    """
+    Submits the queued tasks that fit, see submit_fitting, then waits until at least one running task finishes.
+    Callers clear the queue to stop submitting, for example after a failure.
+    :param executor:
+    :param pool: the free resources, updated with the submitted and the finished tasks
+    :param queued: the (key, task) pairs to submit, updated with the tasks that are still queued
+    :param running: the (key, task) pairs by future, updated with the submitted and the finished tasks
+    :return: the (key, task, future) of the finished tasks
+    """
+    submit_fitting(executor, pool, queued, running)
+    if len(running) == 0:
+        return []
+
+    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+    finished = []
+    for future in done:
+        key, t = running.pop(future)
+        pool.release(t)
+        finished.append((key, t, future))
+
+    return finished
 
 
 def load_runtime(workdir):
+    # A pipeline that failed before its first stage finished has no runtime yet.
+    if not os.path.exists(f'{workdir}/runtime.json'):
+        return {}
+
     with open(f'{workdir}/runtime.json', 'r') as f:
         return json.loads(f.read())
 
@@ -15,6 +106,58 @@ def save_runtime(workdir, runtime):
         return f.write(json.dumps(runtime, indent=True))
 
 
+def load_subtasks_runtime(workdir) -> dict:
+    path = f'{workdir}/runtime_subtasks.json'
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
+
+def save_subtasks_runtime(workdir, subtasks_runtime: dict):
+    with open(f'{workdir}/runtime_subtasks.json', 'w') as f:
+        return f.write(json.dumps(subtasks_runtime, indent=True))
+
+
+def record_stage_telemetry(workdir, stages_telemetry: dict, stage, stage_task, start):
+    """
+    Saves the totals of the tasks of a finished stage in runtime_telemetry.json.
+    :param workdir: the workdir of the pipeline
+    :param stages_telemetry: the telemetry by stage, updated with the stage
+    :param stage:
+    :param stage_task: the executed task, or the list of executed subtasks
+    :param start: the time when the stage started
+    """
+    stage_tasks = stage_task if type(stage_task) == list else [stage_task]
+    telemetries = [t['telemetry'] for t in stage_tasks if 'telemetry' in t]
+
+    stages_telemetry[stage] = aggregate_telemetry(telemetries, time.time() - start)
+    save_telemetry(f'{workdir}/runtime_telemetry.json', stages_telemetry)
+
+
+def restore_subtask(subtasks_runtime: dict, stage, i) -> Optional[dict]:
+    """
+    The subtasks of a parallel stage are matched by position,
+    so the stage definition must not change between the executions.
+    :param subtasks_runtime: the finished subtasks of the unfinished parallel stages, by stage and position
+    :param stage:
+    :param i: the position of the subtask in the stage
+    :return: the executed subtask, if it was closed
+    """
+    subtask = subtasks_runtime.get(stage, {}).get(str(i))
+
+    if subtask is None or not os.path.exists(f"{subtask['workdir']}/closing.time"):
+        return None
+
+    return subtask
+
+
+def record_subtask(workdir, subtasks_runtime: dict, stage, i, subtask: dict):
+    subtasks_runtime.setdefault(stage, {})[str(i)] = subtask
+    save_subtasks_runtime(workdir, subtasks_runtime)
+
+
 def execute_pipeline(task: dict):
     workdir = task['workdir']
     stages = task['stages']
@@ -22,8 +165,21 @@ def execute_pipeline(task: dict):
     if 'resume' in task:
         runtime = load_runtime(task['resume'])
         save_runtime(workdir, runtime)
+
+        subtasks_runtime = load_subtasks_runtime(task['resume'])
+        save_subtasks_runtime(workdir, subtasks_runtime)
+
+        stages_telemetry = load_telemetry(f"{task['resume']}/runtime_telemetry.json")
+        save_telemetry(f'{workdir}/runtime_telemetry.json', stages_telemetry)
     else:
         runtime = {}
+        subtasks_runtime = {}
+        stages_telemetry = {}
+
+    if 'dependencies' in task:
+        execute_dag_pipeline(task, runtime, subtasks_runtime, stages_telemetry)
+        print(f'Finished pipeline {workdir}')
+        return
 
     for stage in stages:
         if stage in runtime:
@@ -31,23 +187,11 @@ def execute_pipeline(task: dict):
             continue
 
         stage_task = stages[stage]
+        start = time.time()
 
         try:
             if type(stage_task) == list:
-                concurrent_jobs = task['parallel_processes']
-
-                for t in stage_task:
-                    t['upstream'] = runtime.copy()
-
-                # Sub-processes update the task with
-                # job and workdir information, which this pipeline
-                # needs to capture so that the runtime object is complete.
-                stage_task = Parallel(n_jobs=concurrent_jobs, verbose=10)([
-                    delayed(execute)(t) for t in stage_task
-                ])
-
-                for t in stage_task:
-                    del t['upstream']
+                stage_task = execute_parallel_stage(task, stage, runtime, subtasks_runtime)
             else:
                 stage_task['upstream'] = runtime.copy()
                 execute(stage_task)
@@ -58,7 +202,215 @@ def execute_pipeline(task: dict):
             raise e
 
         runtime[stage] = stage_task
+        subtasks_runtime.pop(stage, None)
 
         save_runtime(task['workdir'], runtime)
+        save_subtasks_runtime(workdir, subtasks_runtime)
+        record_stage_telemetry(workdir, stages_telemetry, stage, stage_task, start)
+
+    print(f'Finished pipeline {workdir}')
+
+
+def execute_parallel_stage(task: dict, stage, runtime: dict, subtasks_runtime: dict) -> list:
+    """
+    Executes the subtasks of a list-typed stage in task['parallel_processes'] processes,
+    starting a subtask only when its declared resources are free.
+    Every finished subtask is recorded in runtime_subtasks.json,
+    so that resuming the pipeline executes only the failed or missing subtasks.
+    :return: the executed subtasks
+    """
+    workdir = task['workdir']
+    subtasks = task['stages'][stage]
+
+    executed = [restore_subtask(subtasks_runtime, stage, i) for i in range(len(subtasks))]
+    pending = [i for i, t in enumerate(executed) if t is None]
+
+    if len(pending) < len(subtasks):
+        print(f'Stage {stage}: {len(subtasks) - len(pending)} of {len(subtasks)} subtasks restored from runtime')
+
+    executor = get_worker_pool(task)
+    pool = ResourcePool.from_task(task)
+
+    # The executor pickles the subtasks later, so they must not be modified after the submission.
+    queued = [(i, dict(subtasks[i], upstream=runtime.copy())) for i in pending]
+    for _, t in queued:
+        pool.check(t)
+
+    running = {}
+    failure = None
+
+    while len(queued) + len(running) > 0:
+        for i, t, future in wait_fitting(executor, pool, queued, running):
+            if future.exception() is not None:
+                failure = failure or future.exception()
+                queued.clear()
+                continue
+
+            # Sub-processes update the task with
+            # job and workdir information, which this pipeline
+            # needs to capture so that the runtime object is complete.
+            subtask = future.result()
+            del subtask['upstream']
+
+            executed[i] = subtask
+            record_subtask(workdir, subtasks_runtime, stage, i, subtask)
+
+    if failure is not None:
+        raise failure
+
+    return executed
+
+
+def get_upstream_stages(dependencies: dict, stage) -> list:
+    """
+    :param dependencies: the upstream stages by stage
+    :param stage:
+    :return: the direct and transitive upstream stages of the stage
+    """
+    upstream = []
+    pending = list(dependencies.get(stage, []))
+
+    while len(pending) > 0:
+        current = pending.pop()
+        if current in upstream:
+            continue
+
+        upstream.append(current)
+        pending += dependencies.get(current, [])
+
+    return upstream
+
+
+def sort_stages(stages: dict, dependencies: dict) -> list:
+    """
+    :param stages:
+    :param dependencies: the upstream stages by stage
+    :return: the stages in an order where every stage follows its upstream stages
+    :raises ValueError: if the dependencies have unknown stages or cycles
+    """
+    for stage, upstream in dependencies.items():
+        unknown = [u for u in [stage] + list(upstream) if u not in stages]
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown stages in the dependencies: {unknown}')
+
+    ordered = []
+    pending = list(stages)
+
+    while len(pending) > 0:
+        ready = [s for s in pending if all(u in ordered for u in dependencies.get(s, []))]
+        if len(ready) == 0:
+            raise ValueError(f'Stages {pending} have cyclic dependencies')
+
+        ordered += ready
+        pending = [s for s in pending if s not in ready]
+
+    return ordered
+
+
+def execute_dag_pipeline(task: dict, runtime: dict, subtasks_runtime: dict, stages_telemetry: dict):
+    """
+    Executes the stages as soon as their upstream stages finish,
+    sharing a pool of task['parallel_processes'] processes between all running stages.
+    Each stage is passed only the runtime of its upstream stages.
+    task['dependencies'] lists the upstream stages by stage, stages that are not listed have none.
+    A task starts only when its declared resources are free, see ResourcePool.
+    :param task: the pipeline task
+    :param runtime: the runtime restored from a previous execution, updated as the stages finish
+    :param subtasks_runtime: the finished subtasks of the unfinished parallel stages, updated as they finish
+    :param stages_telemetry: the telemetry by stage, updated as the stages finish
+    """
+    workdir = task['workdir']
+    stages = task['stages']
+    dependencies = task['dependencies']
+
+    # The whole graph is validated before any stage starts.
+    sort_stages(stages, dependencies)
+
+    for stage in stages:
+        if stage in runtime:
+            print(f'Stage {stage} restored from runtime')
+
+    waiting = [stage for stage in stages if stage not in runtime]
+    queued = []
+    running = {}
+    remaining = {}
+    results = {}
+    started = {}
+    failure = None
+
+    executor = get_worker_pool(task)
+    pool = ResourcePool.from_task(task)
+
+    for stage in waiting:
+        for t in stages[stage] if type(stages[stage]) == list else [stages[stage]]:
+            pool.check(t)
+
+    def finish_subtask(stage, i, subtask):
+        results[stage][i] = subtask
+        remaining[stage] -= 1
+
+        if remaining[stage] > 0:
+            record_subtask(workdir, subtasks_runtime, stage, i, subtask)
+            return
+
+        runtime[stage] = results[stage] if type(stages[stage]) == list else results[stage][0]
+        subtasks_runtime.pop(stage, None)
+
+        save_runtime(workdir, runtime)
+        save_subtasks_runtime(workdir, subtasks_runtime)
+        record_stage_telemetry(workdir, stages_telemetry, stage, runtime[stage], started[stage])
+        print(f'Stage {stage} finished')
+
+    while len(waiting) + len(queued) + len(running) > 0:
+        ready = [
+            stage for stage in waiting
+            if failure is None and all(u in runtime for u in dependencies.get(stage, []))
+        ]
+
+        for stage in ready:
+            waiting.remove(stage)
+            stage_tasks = stages[stage] if type(stages[stage]) == list else [stages[stage]]
+            upstream = {u: runtime[u] for u in get_upstream_stages(dependencies, stage)}
+
+            remaining[stage] = len(stage_tasks)
+            results[stage] = [None] * len(stage_tasks)
+            started[stage] = time.time()
+
+            if len(stage_tasks) == 0:
+                runtime[stage] = []
+                save_runtime(workdir, runtime)
+                record_stage_telemetry(workdir, stages_telemetry, stage, [], started[stage])
+
+            for i, t in enumerate(stage_tasks):
+                restored = restore_subtask(subtasks_runtime, stage, i) if type(stages[stage]) == list else None
+
+                if restored is not None:
+                    finish_subtask(stage, i, restored)
+                else:
+                    # The executor pickles the task later, so it must not be modified after the submission.
+                    queued.append(((stage, i), dict(t, upstream=upstream)))
+
+        if len(queued) + len(running) == 0:
+            if failure is not None:
+                break
+            if len(ready) == 0:
+                raise ValueError(f'Stages {waiting} have cyclic dependencies')
+            # Stages fully restored from the subtasks runtime may have made other stages ready.
+            continue
+
+        for (stage, i), t, future in wait_fitting(executor, pool, queued, running):
+            if future.exception() is not None:
+                print(f'Stage {stage} failed, resume from {workdir}')
+                failure = failure or future.exception()
+                queued.clear()
+                continue
+
+            # Sub-processes update the task with
+            # job and workdir information, which this pipeline
+            # needs to capture so that the runtime object is complete.
+            stage_task = future.result()
+            del stage_task['upstream']
+            finish_subtask(stage, i, stage_task)
 
-    print(f'Finished pipeline {workdir}')
\ No newline at end of file
+    if failure is not None:
+        raise failure
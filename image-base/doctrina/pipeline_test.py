@@ -0,0 +1,147 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from doctrina.pipeline import execute_pipeline, get_worker_pool, sort_stages
+
+storage = None
+environment = None
+
+
+def setUpModule():
+    global storage, environment
+    storage = tempfile.TemporaryDirectory()
+
+    # The worker processes inherit the environment when the pool starts.
+    environment = mock.patch.dict(os.environ, {"APP_STORAGE_PATH": storage.name, "APP_S3_BUCKET_PRIVATE": ""})
+    environment.start()
+
+
+def tearDownModule():
+    environment.stop()
+    storage.cleanup()
+
+
+def record(task):
+    """
+    Records the execution in the log of the test, and fails if the task has a missing flag file.
+    """
+    with open(task["log"], "a") as f:
+        f.write(json.dumps({"name": task["name"], "upstream": sorted(task["upstream"]), "time": time.time()}) + "\n")
+
+    if "flag" in task and not os.path.exists(task["flag"]):
+        raise RuntimeError(f"{task['name']} failed")
+
+    time.sleep(task.get("sleep", 0))
+
+
+def is_imported(module_path):
+    return module_path in sys.modules
+
+
+class WorkerPoolTest(TestCase):
+    def test_preload_modules(self):
+        # A module that neither the workers nor doctrina import otherwise.
+        module = "xml.dom.minidom"
+
+        executor = get_worker_pool({"parallel_processes": 1, "preload_modules": []})
+        self.assertFalse(executor.submit(is_imported, module).result())
+        self.assertIs(executor, get_worker_pool({"parallel_processes": 1, "preload_modules": []}))
+
+        preloading = get_worker_pool({"parallel_processes": 1, "preload_modules": [module]})
+        self.assertTrue(preloading.submit(is_imported, module).result())
+
+
+class DagPipelineTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(dir=storage.name)
+        self.log = f"{self.root}/log.jsonl"
+
+    def make_task(self, name, **kwargs):
+        return dict({"function": [__name__, "record"], "workspace": "test", "name": name, "log": self.log}, **kwargs)
+
+    def make_pipeline(self, stages, dependencies, **kwargs):
+        workdir = tempfile.mkdtemp(dir=self.root)
+        pipeline = {"workdir": workdir, "parallel_processes": 2, "cpus": 2}
+        return dict(pipeline, stages=stages, dependencies=dependencies, **kwargs)
+
+    def read_log(self):
+        if not os.path.exists(self.log):
+            return []
+
+        with open(self.log, "r") as f:
+            return [json.loads(line) for line in f]
+
+    def test_sort_stages(self):
+        order = sort_stages({"d": 0, "c": 0, "b": 0, "a": 0}, {"d": ["b", "c"], "b": ["a"]})
+        self.assertLess(order.index("a"), order.index("b"))
+        self.assertLess(order.index("b"), order.index("d"))
+        self.assertLess(order.index("c"), order.index("d"))
+
+    def test_ready_order_and_upstream(self):
+        pipeline = self.make_pipeline(
+            {
+                "a": self.make_task("a", sleep=1),
+                "b": self.make_task("b"),
+                "c": [self.make_task("c0"), self.make_task("c1")],
+                "d": self.make_task("d"),
+            },
+            {"b": ["a"], "d": ["b", "c"]},
+        )
+        execute_pipeline(pipeline)
+
+        log = {entry["name"]: entry for entry in self.read_log()}
+        self.assertEqual({"a", "b", "c0", "c1", "d"}, set(log))
+
+        # c does not wait for a, b does.
+        self.assertLess(log["c0"]["time"], log["a"]["time"] + 1)
+        self.assertGreater(log["b"]["time"], log["a"]["time"] + 1)
+
+        self.assertEqual([], log["a"]["upstream"])
+        self.assertEqual(["a"], log["b"]["upstream"])
+        self.assertEqual(["a", "b", "c"], log["d"]["upstream"])
+
+    def test_cycles_are_rejected_before_execution(self):
+        pipeline = self.make_pipeline(
+            {"a": self.make_task("a"), "b": self.make_task("b"), "c": self.make_task("c")},
+            {"a": ["b"], "b": ["a"]},
+        )
+
+        with self.assertRaises(ValueError):
+            execute_pipeline(pipeline)
+
+        self.assertEqual([], self.read_log())
+
+    def test_resume_skips_closed_subtasks(self):
+        flag = f"{self.root}/flag"
+        stages = {
+            "a": [self.make_task("a0"), self.make_task("a1", flag=flag), self.make_task("a2")],
+            "b": self.make_task("b"),
+        }
+
+        failed = self.make_pipeline(stages, {"b": ["a"]})
+        with self.assertRaises(RuntimeError):
+            execute_pipeline(failed)
+
+        open(flag, "w").close()
+        execute_pipeline(self.make_pipeline(stages, {"b": ["a"]}, resume=failed["workdir"]))
+
+        # a2 runs in either execution, depending on whether it started before the failure,
+        # but the subtasks that closed are never executed again.
+        names = [e["name"] for e in self.read_log()]
+        self.assertEqual(["a0", "a1", "a1", "a2", "b"], sorted(names))
+
+    def test_restored_stages_unblock_downstream(self):
+        stages = {"a": self.make_task("a"), "b": self.make_task("b")}
+
+        first = self.make_pipeline({"a": stages["a"]}, {})
+        execute_pipeline(first)
+
+        with mock.patch("builtins.print"):
+            execute_pipeline(self.make_pipeline(stages, {"b": ["a"]}, resume=first["workdir"]))
+
+        self.assertEqual(["a", "b"], [e["name"] for e in self.read_log()])
+        self.assertEqual(["a"], self.read_log()[1]["upstream"])
@@ -0,0 +1,127 @@
+import os
+import sys
+
+THREAD_VARIABLES = [
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'TF_NUM_INTRAOP_THREADS',
+    'TF_NUM_INTEROP_THREADS',
+]
+
+MEMORY_UNITS = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_memory(memory) -> int:
+    """
+    :param memory: bytes, or a string such as 512M or 4G
+    :return: bytes
+    """
+    if isinstance(memory, str) and memory[-1].upper() in MEMORY_UNITS:
+        return int(float(memory[:-1]) * MEMORY_UNITS[memory[-1].upper()])
+
+    return int(memory)
+
+
+def get_available_memory() -> int:
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        # Not every image has psutil.
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def get_available_cpus() -> int:
+    # The affinity of the process follows the CPU sets of containers, unlike os.cpu_count.
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count()
+
+
+class ResourcePool:
+    """
+    Tracks the CPUs and memory that the running tasks of a pipeline have declared,
+    so that tasks are only started when their resources are free.
+    A task declares task['resources'] = {'cpus': 2, 'memory': '4G'}.
+    Only the declared resources are reserved, so tasks without them run up to the number of processes,
+    with their threads limited to an equal share of the CPUs.
+    """
+
+    def __init__(self, cpus, memory, processes):
+        self.cpus = cpus
+        self.memory = memory
+        self.processes = processes
+        self.default_cpus = max(1, cpus // processes)
+        self.free_cpus = cpus
+        self.free_memory = memory
+
+    @staticmethod
+    def from_task(task: dict) -> 'ResourcePool':
+        """
+        :param task: the pipeline task, which may declare the available 'cpus' and 'memory'
+        :return:
+        """
+        cpus = task.get('cpus', get_available_cpus())
+        memory = parse_memory(task['memory']) if 'memory' in task else get_available_memory()
+        return ResourcePool(cpus, memory, task.get('parallel_processes', 1))
+
+    def get_cpus(self, task: dict) -> int:
+        """
+        :return: the number of threads of the task
+        """
+        return task.get('resources', {}).get('cpus', self.default_cpus)
+
+    def get_reserved_cpus(self, task: dict) -> int:
+        return task.get('resources', {}).get('cpus', 0)
+
+    def get_memory(self, task: dict) -> int:
+        return parse_memory(task.get('resources', {}).get('memory', 0))
+
+    def check(self, task: dict):
+        """
+        :raises ValueError: if the task can never fit in the pool
+        """
+        if self.get_reserved_cpus(task) > self.cpus:
+            raise ValueError(f'Task requires {self.get_reserved_cpus(task)} CPUs, but only {self.cpus} are available')
+
+        if self.get_memory(task) > self.memory:
+            raise ValueError(f'Task requires {self.get_memory(task)} bytes, but only {self.memory} are available')
+
+    def fits(self, task: dict) -> bool:
+        return self.get_reserved_cpus(task) <= self.free_cpus and self.get_memory(task) <= self.free_memory
+
+    def acquire(self, task: dict):
+        self.free_cpus -= self.get_reserved_cpus(task)
+        self.free_memory -= self.get_memory(task)
+
+    def release(self, task: dict):
+        self.free_cpus += self.get_reserved_cpus(task)
+        self.free_memory += self.get_memory(task)
+
+
+def limit_threads(cpus):
+    """
+    Limits the threads of BLAS, OpenMP and TensorFlow in this process.
+    The variables apply to the libraries loaded later, threadpoolctl to the ones already loaded.
+    :param cpus:
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(cpus)
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=cpus)
+    except ImportError:
+        pass
+
+    if 'tensorflow' in sys.modules:
+        tf = sys.modules['tensorflow']
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(cpus)
+            tf.config.threading.set_inter_op_parallelism_threads(cpus)
+        except RuntimeError:
+            # TensorFlow was already initialized by a previous task of this worker.
+            pass
@@ -0,0 +1,61 @@
+from unittest import TestCase, mock
+
+from doctrina.pipeline import submit_fitting
+from doctrina.resources import ResourcePool, parse_memory
+
+
+class ResourcePoolTest(TestCase):
+    def test_parse_memory(self):
+        self.assertEqual(512 * 2 ** 20, parse_memory('512M'))
+        self.assertEqual(3 * 2 ** 29, parse_memory('1.5G'))
+        self.assertEqual(1000, parse_memory(1000))
+
+    def test_packing(self):
+        pool = ResourcePool.from_task({'cpus': 4, 'memory': '1G', 'parallel_processes': 4})
+        large = {'resources': {'cpus': 3}}
+        heavy = {'resources': {'cpus': 1, 'memory': '600M'}}
+
+        pool.acquire(large)
+        pool.acquire(heavy)
+        self.assertFalse(pool.fits(heavy))
+        self.assertFalse(pool.fits({'resources': {'cpus': 1}}))
+        # Tasks without declared resources reserve nothing.
+        self.assertTrue(pool.fits({}))
+
+        pool.release(large)
+        self.assertTrue(pool.fits({'resources': {'cpus': 1}}))
+        self.assertFalse(pool.fits(heavy))
+
+    def test_oversubscription(self):
+        pool = ResourcePool.from_task({'cpus': 2, 'memory': '1G'})
+        with self.assertRaises(ValueError):
+            pool.check({'resources': {'memory': '2G'}})
+        with self.assertRaises(ValueError):
+            pool.check({'resources': {'cpus': 3}})
+
+
+class SubmitFittingTest(TestCase):
+    def test_running_tasks_are_limited_by_processes(self):
+        executor = mock.Mock()
+        executor.submit.side_effect = lambda *args: object()
+        pool = ResourcePool.from_task({'cpus': 8, 'memory': '1G', 'parallel_processes': 2})
+
+        queued = [(i, {'resources': {'cpus': 1}}) for i in range(4)]
+        running = {}
+        submit_fitting(executor, pool, queued, running)
+
+        self.assertEqual(2, len(running))
+        self.assertEqual([2, 3], [i for i, _ in queued])
+        self.assertEqual(6, pool.free_cpus)
+
+    def test_undeclared_tasks_run_up_to_processes(self):
+        executor = mock.Mock()
+        executor.submit.side_effect = lambda *args: object()
+        pool = ResourcePool.from_task({'cpus': 2, 'memory': '1G', 'parallel_processes': 4})
+
+        queued = [(i, {}) for i in range(5)]
+        running = {}
+        submit_fitting(executor, pool, queued, running)
+
+        self.assertEqual(4, len(running))
+        self.assertEqual([1] * 4, [c.args[2] for c in executor.submit.call_args_list])
@@ -0,0 +1,227 @@
+import functools
+import json
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from doctrina.lazy import lazy_import
+from doctrina.telemetry import record_upload
+
+boto3 = lazy_import('boto3')
+transfer = lazy_import('boto3.s3.transfer')
+botocore_config = lazy_import('botocore.config')
+
+MANIFEST_NAME = '.s3_manifest.json'
+
+FILE_CONCURRENCY = 8
+
+PART_CONCURRENCY = 8
+
+
+@functools.lru_cache(maxsize=None)
+def get_transfer_config():
+    # Files above the threshold are uploaded in concurrent parts.
+    return transfer.TransferConfig(
+        multipart_threshold=64 * 1024 * 1024,
+        multipart_chunksize=16 * 1024 * 1024,
+        max_concurrency=PART_CONCURRENCY,
+    )
+
+
+def get_s3_client():
+    """
+    :return: the S3 client of this process, which is thread-safe and shared by all uploads
+    """
+    return get_process_s3_client(os.getpid())
+
+
+@functools.lru_cache(maxsize=None)
+def get_process_s3_client(pid):
+    # Clients must not be shared across forked processes, hence the cache by pid.
+    session = boto3.session.Session()
+    config = botocore_config.Config(max_pool_connections=FILE_CONCURRENCY * PART_CONCURRENCY)
+    return session.client('s3', config=config)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sync_executor(pid) -> ThreadPoolExecutor:
+    # A single thread, so that the syncs of the same workdir never overlap.
+    return ThreadPoolExecutor(max_workers=1)
+
+
+def load_manifest(workdir) -> dict:
+    path = f'{workdir}/{MANIFEST_NAME}'
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
+
+def save_manifest(workdir, manifest: dict):
+    with open(f'{workdir}/{MANIFEST_NAME}', 'w') as f:
+        f.write(json.dumps(manifest, indent=True))
+
+
+def list_changed_files(workdir, manifest: dict) -> dict:
+    """
+    :param workdir:
+    :param manifest: the size and mtime of the uploaded files by relative path
+    :return: the size and mtime of the new or modified files by relative path
+    """
+    changed = {}
+
+    for root, dirs, files in os.walk(workdir):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, workdir)
+            if relative == MANIFEST_NAME:
+                continue
+
+            stat = os.stat(path)
+            version = [stat.st_size, stat.st_mtime_ns]
+            if manifest.get(relative) != version:
+                changed[relative] = version
+
+    return changed
+
+
+def sync_workdir(workdir, bucket) -> dict:
+    """
+    Uploads the files of a workdir that changed since the last sync to s3://{bucket}{workdir}.
+    :param workdir:
+    :param bucket:
+    :return: the uploaded files by relative path
+    """
+    client = get_s3_client()
+    manifest = load_manifest(workdir)
+    changed = list_changed_files(workdir, manifest)
+    prefix = workdir.strip('/')
+
+    def upload(relative):
+        start = time.time()
+        client.upload_file(
+            f'{workdir}/{relative}',
+            bucket,
+            f'{prefix}/{relative}',
+            Config=get_transfer_config(),
+        )
+        record_upload(time.time() - start, changed[relative][0])
+
+    with ThreadPoolExecutor(max_workers=FILE_CONCURRENCY) as executor:
+        list(executor.map(upload, changed))
+
+    manifest.update(changed)
+    save_manifest(workdir, manifest)
+
+    return changed
+
+
+def submit_sync_workdir(workdir, bucket) -> Future:
+    """
+    Syncs a workdir in the background, after the previously submitted syncs of this process.
+    :param workdir:
+    :param bucket:
+    :return:
+    """
+    return get_sync_executor(os.getpid()).submit(sync_workdir, workdir, bucket)
+
+
+def list_prefix(bucket, prefix) -> list:
+    """
+    :param bucket:
+    :param prefix:
+    :return: the (key, size) of every object under the prefix
+    """
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+
+    objects = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects += [(o['Key'], o['Size']) for o in page.get('Contents', [])]
+
+    return objects
+
+
+def delete_keys(bucket, keys: list, max_workers=FILE_CONCURRENCY):
+    """
+    Deletes objects in batches of 1000 keys, the limit of a single DeleteObjects request.
+    :param bucket:
+    :param keys:
+    :param max_workers: the number of concurrent requests
+    """
+    client = get_s3_client()
+    batches = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+
+    def delete(batch):
+        response = client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True},
+        )
+
+        errors = response.get('Errors', [])
+        if len(errors) > 0:
+            raise Exception(f'Failed to delete {len(errors)} objects, for example {errors[0]}')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(delete, batches))
+
+
+PUBLIC_UPLOAD_CONCURRENCY = 4
+
+# The background uploads that the current task of each process has not waited for, by pid,
+# so that a forked process never waits for the uploads of its parent.
+pending_uploads = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_upload_executor(pid) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=PUBLIC_UPLOAD_CONCURRENCY)
+
+
+def submit_upload(function, *args, **kwargs) -> Future:
+    """
+    Runs an upload to S3 in the background, with at most PUBLIC_UPLOAD_CONCURRENCY uploads at a time.
+    :param function: called with the S3 client and the given arguments
+    :return:
+    """
+    return submit_background_upload(timed_upload, function, get_s3_client(), *args, **kwargs)
+
+
+def submit_background_upload(function, *args, **kwargs) -> Future:
+    """
+    Runs an upload that does not go through the S3 client of this process in the background,
+    such as the artifacts of an MLflow run, sharing the threads and flush_uploads with submit_upload.
+    :param function: called with the given arguments
+    :return:
+    """
+    future = get_upload_executor(os.getpid()).submit(function, *args, **kwargs)
+    pending_uploads.setdefault(os.getpid(), []).append(future)
+    return future
+
+
+def timed_upload(function, client, *args, **kwargs):
+    start = time.time()
+    try:
+        return function(client, *args, **kwargs)
+    finally:
+        record_upload(time.time() - start, 0)
+
+
+def flush_uploads():
+    """
+    Waits for the background uploads of the current task of this process.
+    :raises Exception: if any of the uploads failed
+    """
+    futures = pending_uploads.pop(os.getpid(), [])
+
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if len(errors) > 0:
+        raise Exception(f'Failed {len(errors)} of {len(futures)} background uploads') from errors[0]
+
+
+def discard_uploads():
+    """
+    Stops tracking the background uploads of the current task of this process, for example after the task failed,
+    so that the next task of the process does not wait for them. The uploads themselves continue.
+    """
+    pending_uploads.pop(os.getpid(), None)
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from doctrina import s3
+
+
+class SyncWorkdirTest(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+
+        self.client = mock.Mock()
+        patcher = mock.patch.object(s3, "get_s3_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, relative, content):
+        os.makedirs(os.path.dirname(f"{self.workdir}/{relative}"), exist_ok=True)
+        with open(f"{self.workdir}/{relative}", "w") as f:
+            f.write(content)
+
+    def sync(self) -> list:
+        """
+        :return: the keys uploaded by the sync
+        """
+        self.client.upload_file.reset_mock()
+        s3.sync_workdir(self.workdir, "bucket")
+        return sorted(c.args[2] for c in self.client.upload_file.call_args_list)
+
+    def test_only_changes_are_uploaded(self):
+        prefix = self.workdir.strip("/")
+        self.write("task.json", "{}")
+        self.write("plots/loss.png", "png")
+
+        self.assertEqual([f"{prefix}/plots/loss.png", f"{prefix}/task.json"], self.sync())
+        self.assertTrue(os.path.exists(f"{self.workdir}/{s3.MANIFEST_NAME}"))
+        self.assertEqual([], self.sync())
+
+        self.write("task.json", '{"closed": true}')
+        self.assertEqual([f"{prefix}/task.json"], self.sync())
+
+
+class DeleteKeysTest(TestCase):
+    def test_batches(self):
+        client = mock.Mock()
+        client.delete_objects.return_value = {}
+
+        with mock.patch.object(s3, "get_s3_client", return_value=client):
+            s3.delete_keys("bucket", [f"key/{i}" for i in range(2500)])
+
+        batches = [c.kwargs["Delete"]["Objects"] for c in client.delete_objects.call_args_list]
+        self.assertEqual([500, 1000, 1000], sorted(len(batch) for batch in batches))
+        self.assertEqual(2500, len({o["Key"] for batch in batches for o in batch}))
+
+    def test_errors_are_raised(self):
+        client = mock.Mock()
+        client.delete_objects.return_value = {"Errors": [{"Key": "key/0", "Code": "AccessDenied"}]}
+
+        with mock.patch.object(s3, "get_s3_client", return_value=client):
+            with self.assertRaises(Exception):
+                s3.delete_keys("bucket", ["key/0"])
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import itertools
+from typing import Iterable, Iterator, Tuple
+
+from doctrina.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+pq = lazy_import('pyarrow.parquet')
+
+
+def iter_pq_frames(path, batch_size, columns=None) -> Iterator[pd.DataFrame]:
+    """
+    Reads a parquet file one record batch at a time.
+    :param path:
+    :param batch_size: the maximum number of rows per frame
+    :param columns: the columns to read, or None for all columns
+    :return:
+    """
+    file = pq.ParquetFile(path)
+
+    # Arrow rebuilds a stored RangeIndex from zero for every batch, see read_parquet.
+    index_columns = (file.schema_arrow.pandas_metadata or {}).get('index_columns', [])
+    range_index = index_columns[0] if len(index_columns) == 1 and isinstance(index_columns[0], dict) else None
+    start = 0
+
+    for batch in file.iter_batches(batch_size=batch_size, columns=columns, use_pandas_metadata=True):
+        frame = batch.to_pandas()
+
+        if range_index is not None:
+            first = range_index['start'] + start * range_index['step']
+            frame.index = pd.RangeIndex(
+                first,
+                first + frame.shape[0] * range_index['step'],
+                range_index['step'],
+                name=range_index['name'],
+            )
+
+        start += frame.shape[0]
+        yield frame
+
+
+def iter_h5_frames(path, key, batch_size) -> Iterator[pd.DataFrame]:
+    """
+    Reads an HDF object one chunk of rows at a time.
+    :param path:
+    :param key:
+    :param batch_size: the number of rows per frame
+    :return:
+    """
+    with pd.HDFStore(path, mode='r') as store:
+        start = 0
+
+        while True:
+            frame = store.select(key, start=start, stop=start + batch_size)
+            if frame.shape[0] == 0:
+                return
+
+            yield frame
+            start += frame.shape[0]
+
+
+def rebatch(frames: Iterable[pd.DataFrame], batch_size) -> Iterator[pd.DataFrame]:
+    """
+    Re-slices frames of any length into frames of exactly batch_size rows, except for the last frame.
+    :param frames:
+    :param batch_size:
+    :return:
+    """
+    buffer = []
+    buffered = 0
+
+    for frame in frames:
+        buffer.append(frame)
+        buffered += frame.shape[0]
+
+        while buffered >= batch_size:
+            joined = pd.concat(buffer) if len(buffer) > 1 else buffer[0]
+            yield joined.iloc[:batch_size]
+
+            buffer = [joined.iloc[batch_size:]]
+            buffered -= batch_size
+
+    if buffered > 0:
+        yield pd.concat(buffer) if len(buffer) > 1 else buffer[0]
+
+
+def zip_streams(streams: list, batch_size) -> Iterator[Tuple[pd.DataFrame, ...]]:
+    """
+    Aligns several streams of frames, such as X and y, into tuples of batches with equal numbers of rows.
+    :param streams:
+    :param batch_size:
+    :return:
+    """
+    rebatched = [rebatch(stream, batch_size) for stream in streams]
+
+    for frames in itertools.zip_longest(*rebatched):
+        if any(f is None for f in frames) or len({f.shape[0] for f in frames}) > 1:
+            raise ValueError('The streamed splits have different numbers of rows')
+
+        yield frames
+
+
+def shuffle_stream(
+        batches: Iterable[Tuple[pd.DataFrame, ...]],
+        buffer_size,
+        seed=None
+) -> Iterator[Tuple[pd.DataFrame, ...]]:
+    """
+    Shuffles the rows of aligned batches within a buffer of buffer_size rows,
+    similarly to tf.data.Dataset.shuffle. The rows of all frames in a tuple are permuted together.
+    The buffer is permuted once per half of it being emitted, so each row is copied a constant number of times.
+    :param batches:
+    :param buffer_size: the number of rows to shuffle among, larger values give a more uniform shuffle
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    pending = []
+    buffered = 0
+    batch_size = None
+
+    def permute():
+        frames = tuple(pd.concat(parts) for parts in zip(*pending))
+        idx = rng.permutation(frames[0].shape[0])
+        return tuple(f.iloc[idx] for f in frames)
+
+    for batch in batches:
+        if batch_size is None:
+            batch_size = batch[0].shape[0]
+
+        pending.append(batch)
+        buffered += batch[0].shape[0]
+
+        if buffered >= buffer_size + batch_size:
+            buffer = permute()
+            emitted = (buffered - buffer_size // 2) // batch_size * batch_size
+
+            for start in range(0, emitted, batch_size):
+                yield tuple(f.iloc[start:start + batch_size] for f in buffer)
+
+            pending = [tuple(f.iloc[emitted:] for f in buffer)]
+            buffered -= emitted
+
+    if buffered == 0:
+        return
+
+    buffer = permute()
+    for start in range(0, buffered, batch_size):
+        yield tuple(f.iloc[start:start + batch_size] for f in buffer)
+
+
+def to_numpy_stream(batches: Iterable[Tuple[pd.DataFrame, ...]]) -> Iterator[Tuple[np.ndarray, ...]]:
+    """
+    Converts batches of frames into batches of arrays, as expected by Keras generators.
+    :param batches:
+    :return:
+    """
+    for batch in batches:
+        yield tuple(f.to_numpy() for f in batch)
+
+
+class ShuffledView:
+    """
+    A shuffled view of aligned frames, such as X and y, which holds only a permutation of row positions.
+    Rows are copied one batch at a time, and each epoch can be reshuffled without copying the frames.
+    """
+
+    def __init__(self, frames: Tuple[pd.DataFrame, ...], seed=None):
+        if len({f.shape[0] for f in frames}) > 1:
+            raise ValueError('The shuffled frames have different numbers of rows')
+
+        self.frames = frames
+        self.rng = np.random.default_rng(seed)
+        self.index = self.rng.permutation(frames[0].shape[0])
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def reshuffle(self) -> 'ShuffledView':
+        self.index = self.rng.permutation(self.index.shape[0])
+        return self
+
+    def batches(self, batch_size) -> Iterator[Tuple[pd.DataFrame, ...]]:
+        """
+        :param batch_size:
+        :return: the batches of one epoch in the current order
+        """
+        for start in range(0, len(self), batch_size):
+            idx = self.index[start:start + batch_size]
+            yield tuple(f.iloc[idx] for f in self.frames)
+
+    def epochs(self, batch_size, epochs=None) -> Iterator[Tuple[pd.DataFrame, ...]]:
+        """
+        Yields the batches of consecutive epochs, reshuffling between them,
+        for example as a Keras generator with steps_per_epoch = ceil(len(view) / batch_size).
+        :param batch_size:
+        :param epochs: the number of epochs, or None to repeat forever
+        :return:
+        """
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            if epoch > 0:
+                self.reshuffle()
+
+            yield from self.batches(batch_size)
+            epoch += 1
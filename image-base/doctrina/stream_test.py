@@ -0,0 +1,82 @@
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from doctrina.stream import ShuffledView, iter_h5_frames, iter_pq_frames, rebatch, shuffle_stream, zip_streams
+
+
+def frames_of(sizes):
+    start = 0
+    for size in sizes:
+        yield pd.DataFrame({"v": np.arange(start, start + size)})
+        start += size
+
+
+class StreamTest(TestCase):
+    def test_rebatch(self):
+        actual = [f.shape[0] for f in rebatch(frames_of([3, 30, 1, 9]), 10)]
+        self.assertEqual([10, 10, 10, 10, 3], actual)
+
+    def test_zip_streams_aligned(self):
+        batches = list(zip_streams([frames_of([7, 7, 7]), frames_of([20, 1])], 5))
+        for x, y in batches:
+            self.assertEqual(x["v"].tolist(), y["v"].tolist())
+
+    def test_zip_streams_misaligned(self):
+        with self.assertRaises(ValueError):
+            list(zip_streams([frames_of([10]), frames_of([9])], 5))
+
+    def test_shuffle_stream_keeps_rows_aligned(self):
+        batches = zip_streams([frames_of([50, 53]), frames_of([103])], 10)
+        shuffled = list(shuffle_stream(batches, buffer_size=30, seed=0))
+
+        values = np.concatenate([x["v"].values for x, y in shuffled])
+        self.assertEqual(list(range(103)), sorted(values))
+        self.assertNotEqual(list(range(103)), list(values))
+
+        for x, y in shuffled:
+            self.assertEqual(x["v"].tolist(), y["v"].tolist())
+
+
+class FileStreamTest(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+        self.frame = pd.DataFrame({"a": np.arange(23.0), "b": np.arange(23)}, index=pd.RangeIndex(100, 146, 2))
+
+    def test_iter_pq_frames(self):
+        self.frame.to_parquet(f"{self.workdir}/x.parquet")
+
+        frames = list(iter_pq_frames(f"{self.workdir}/x.parquet", 10, columns=["b"]))
+        self.assertEqual([10, 10, 3], [f.shape[0] for f in frames])
+        pd.testing.assert_frame_equal(self.frame[["b"]], pd.concat(frames))
+
+    def test_iter_h5_frames(self):
+        self.frame.to_hdf(f"{self.workdir}/x.h5", key="x")
+
+        frames = list(iter_h5_frames(f"{self.workdir}/x.h5", "x", 10))
+        self.assertEqual([10, 10, 3], [f.shape[0] for f in frames])
+        pd.testing.assert_frame_equal(self.frame, pd.concat(frames))
+
+
+class ShuffledViewTest(TestCase):
+    def test_epochs_cover_all_rows_aligned(self):
+        x = pd.DataFrame({"v": np.arange(25)})
+        y = pd.DataFrame({"v": np.arange(25)})
+        view = ShuffledView((x, y), seed=0)
+
+        first = view.index.copy()
+        batches = list(view.epochs(10, epochs=2))
+
+        self.assertEqual(6, len(batches))
+        for epoch in [batches[:3], batches[3:]]:
+            values = np.concatenate([bx["v"].values for bx, by in epoch])
+            self.assertEqual(list(range(25)), sorted(values))
+
+        self.assertNotEqual(first.tolist(), view.index.tolist())
+
+        for bx, by in batches:
+            self.assertEqual(bx["v"].tolist(), by["v"].tolist())
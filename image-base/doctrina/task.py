@@ -1,13 +1,24 @@
+from __future__ import annotations
+
 import datetime as dt
+import functools
+import importlib
 import json
 import os
 import random
-
-import boto3
-import mlflow
-
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from doctrina.lazy import lazy_import
+from doctrina.s3 import delete_keys, discard_uploads, flush_uploads, list_prefix, submit_sync_workdir
+from doctrina.task_index import TaskIndex, get_workdir_index, is_task_tagged
+from doctrina.telemetry import Meter, open_meters, save_telemetry
+from doctrina.tracking import get_experiment_id, log_batch, submit_artifacts, to_metrics, to_params
 from doctrina.tree import implode_tree
 
+mlflow = lazy_import('mlflow')
+
 
 def encode(function):
     if '__wrapped_function__' in function.__dict__:
@@ -16,22 +27,36 @@ def encode(function):
     return [function.__module__, function.__name__]
 
 
-def execute(task):
-    module_path = task['function'][0]
-    module = __import__(module_path)
+@functools.lru_cache(maxsize=None)
+def resolve_function(module_path, function_name):
+    module = importlib.import_module(module_path)
+    return getattr(module, function_name)
+
+
+def preload_modules(module_paths):
+    """
+    Imports the modules ahead of the tasks, for example in the initializer of a worker process.
+    :param module_paths:
+    """
+    for module_path in module_paths:
+        importlib.import_module(module_path)
 
-    steps = module_path.split('.')
-    steps.append(task['function'][1])
 
-    current = module
-    for step in steps[1:]:
-        current = getattr(current, step)
+def execute(task):
+    current = resolve_function(task['function'][0], task['function'][1])
 
     task['job'] = task['function'][1]
 
-    start_task(task)
-    current(task)
-    close_task(task)
+    meter = Meter()
+    try:
+        start_task(task)
+        current(task)
+        close_task(task, meter)
+    finally:
+        # The uploads and the meter of a failed task must not leak into the next task of a reused worker.
+        discard_uploads()
+        if meter in open_meters:
+            meter.stop()
 
     return task
 
@@ -42,8 +67,8 @@ def start_task(task):
 
     workspace_job = get_job_path(workspace, job)
 
-    if not os.path.exists(workspace_job):
-        os.makedirs(workspace_job)
+    # Parallel tasks of the same job may create it at the same time.
+    os.makedirs(workspace_job, exist_ok=True)
 
     timestamp = dt.datetime.now().strftime('%Y%m%d-%H%M%S')
     noise = '{0:x}'.format(random.randint(0,2**128))
@@ -57,39 +82,73 @@ def start_task(task):
 
     os.mkdir(workdir)
     save_task(workdir, task)
-    save_workdir_to_private_s3(workdir)
+
+    index, job, task_id = get_workdir_index(workdir)
+    index.add(job, task_id, task)
+
+    # close_task uploads the workdir again and waits for it.
+    save_workdir_to_private_s3(workdir, wait=False)
 
     return workdir
 
 
-def close_task(task):
+def close_task(task, meter: Meter = None):
+    """
+    :param task:
+    :param meter: if given, its measurements up to the final upload of the workdir
+    are saved in task['telemetry'] and in telemetry.json of the workdir
+    """
+    flush_uploads()
 
     workdir = task['workdir']
     with open(f'{workdir}/closing.time', 'w') as f:
         f.write(dt.datetime.now().isoformat())
 
+    index, job, task_id = get_workdir_index(workdir)
+    index.close(job, task_id)
+
     save_workdir_to_private_s3(task['workdir'])
 
+    if meter is not None:
+        task['telemetry'] = meter.stop()
+        save_telemetry(f'{workdir}/telemetry.json', task['telemetry'])
 
-def save_workdir_to_private_s3(workdir):
+        # Only telemetry.json changed since the previous upload, which already reported a missing bucket.
+        if os.environ['APP_S3_BUCKET_PRIVATE'] != '':
+            save_workdir_to_private_s3(task['workdir'])
+
+
+def save_workdir_to_private_s3(workdir, wait=True):
+    """
+    Uploads the files of the workdir that changed since its last upload.
+    :param workdir:
+    :param wait: if False, the upload continues in the background,
+    and a failed upload is retried by the next upload of the workdir
+    """
     bucket = os.environ['APP_S3_BUCKET_PRIVATE']
     if bucket == '':
         print('Skipping S3 upload due to missing bucket')
         return
 
-    code = os.system(f'aws s3 sync {workdir} s3://{bucket}{workdir}')
+    future = submit_sync_workdir(workdir, bucket)
 
-    if code != 0:
-        raise Exception('Failed to save the workdir to S3')
+    if not wait:
+        future.add_done_callback(report_failed_sync)
+        return
 
+    try:
+        future.result()
+    except Exception as e:
+        raise Exception('Failed to save the workdir to S3') from e
 
-def get_last_workdir(workspace: str, job: str):
-    workspace_job = get_job_path(workspace, job)
 
-    past_job_ids = os.listdir(workspace_job)
-    last_job_id = sorted(past_job_ids)[-1]
+def report_failed_sync(future):
+    if future.exception() is not None:
+        print(f'Background upload of the workdir to S3 failed: {future.exception()}')
 
-    return f'{workspace_job}/{last_job_id}'
+
+def get_last_workdir(workspace: str, job: str):
+    return get_task_index(workspace).last_workdir(job)
 
 
 def load_task(workdir):
@@ -103,34 +162,19 @@ def save_task(workdir, task):
         f.write(json.dumps(task, indent=True))
 
 
-def is_task_tagged(task, tag_key, tag_value):
-    if 'tags' not in task:
-        return False
-
-    if tag_key not in task['tags']:
-        return False
-
-    return task['tags'][tag_key] == tag_value
-
-
 def find_tasks_by_tag(workspace, job_name, tag_key, tag_value):
-
-    jobspace = get_job_path(workspace, job_name)
-    workdirs = [f'{jobspace}/{w}' for w in os.listdir(jobspace)]
-
-    all_tasks = {w: load_task(w) for w in workdirs}
-    matching_tasks = {
-        w: t for w, t in all_tasks.items()
-        if is_task_tagged(t, tag_key, tag_value)
-    }
-
-    return matching_tasks
+    index = get_task_index(workspace)
+    return dict(index.find(job=job_name, tag=(tag_key, tag_value)))
 
 
 def get_storage_path():
     return os.environ['APP_STORAGE_PATH']
 
 
+def get_task_index(workspace) -> TaskIndex:
+    return TaskIndex(f'{get_storage_path()}/{workspace}')
+
+
 def get_job_path(workspace, job):
     return f'{get_storage_path()}/{workspace}/jobs/{job}'
 
@@ -144,55 +188,82 @@ def is_task_finished(workspace, job, task_id):
 
 
 def find_incomplete_tasks(workspace):
-    functions = os.listdir(f'{get_storage_path()}/{workspace}/jobs')
+    index = get_task_index(workspace)
+    return [workdir for workdir, task in index.find(closed=False)]
+
 
-    tasks = []
-    for name in functions:
-        tasks += [
-            f'{get_storage_path()}/{workspace}/jobs/{name}/{task_id}'
-            for task_id in os.listdir(f'{get_storage_path()}/{workspace}/jobs/{name}')
-        ]
+def remove_workdirs(workdirs, dry_run=False) -> dict:
+    """
+    Removes the workdirs locally and from the private S3 bucket.
+    :param workdirs:
+    :param dry_run: if True, only counts what would be removed
+    :return: the number of files and bytes removed locally and from S3
+    """
+    workdirs = list(workdirs)
+    bucket = os.environ.get('APP_S3_BUCKET_PRIVATE', '')
+    report = {'workdirs': len(workdirs), 'local_files': 0, 'local_bytes': 0, 's3_objects': 0, 's3_bytes': 0}
+
+    for workdir in workdirs:
+        print(f'Would remove {workdir}' if dry_run else f'Removing {workdir}')
 
-    incomplete_tasks = [
-        task for task in tasks
-        if not os.path.exists(f'{task}/closing.time')
-    ]
+        for root, dirs, files in os.walk(workdir):
+            report['local_files'] += len(files)
+            report['local_bytes'] += sum(os.path.getsize(os.path.join(root, f)) for f in files)
 
-    return incomplete_tasks
+    if bucket != '':
+        # The trailing separator keeps workdirs sharing a name prefix apart.
+        prefixes = [workdir.strip('/') + '/' for workdir in workdirs]
+        with ThreadPoolExecutor() as executor:
+            objects = [o for listed in executor.map(partial(list_prefix, bucket), prefixes) for o in listed]
 
+        report['s3_objects'] = len(objects)
+        report['s3_bytes'] = sum(size for key, size in objects)
 
-def remove_workdirs(workdirs):
-    for workdir in workdirs:
-        print(f'Removing {workdir}')
-        os.system(f'rm -rf {workdir}')
+        if not dry_run:
+            delete_keys(bucket, [key for key, size in objects])
+
+    if not dry_run:
+        for workdir in workdirs:
+            shutil.rmtree(workdir, ignore_errors=True)
 
-        s3 = boto3.resource('s3')
-        bucket = s3.Bucket(os.environ['APP_S3_BUCKET_PRIVATE'])
+            index, job, task_id = get_workdir_index(workdir)
+            index.remove(job, task_id)
 
-        for obj in bucket.objects.all():
-            if obj.key.startswith(workdir[1:]):
-                obj.delete()
+    print(json.dumps(report, indent=True))
+    return report
 
 
-def clean_workspace(workspace):
+def clean_workspace(workspace, dry_run=False):
     """
     :param workspace:
+    :param dry_run: if True, only reports what would be removed
     """
-    remove_workdirs(find_incomplete_tasks(workspace))
+    return remove_workdirs(find_incomplete_tasks(workspace), dry_run=dry_run)
 
 
 def mlflow_run(task_function):
+    """
+    Executes the task function in an MLflow run of task['experiment'], with the task as params.
+    The files of the workdir are logged in the background, and task['mlflow_artifacts'] may limit them
+    to 'include' glob patterns and to files up to 'max_bytes'.
+    """
     def wrapper(task: dict):
-        experiment = mlflow.get_experiment_by_name(task['experiment'])
-        if experiment is None:
-            experiment_id = mlflow.create_experiment(task['experiment'])
-        else:
-            experiment_id = experiment.experiment_id
+        experiment_id = get_experiment_id(task['experiment'])
 
         with mlflow.start_run(experiment_id=experiment_id):
-            mlflow.log_params(implode_tree(task, separator='/'))
-            task_function(task)
-            mlflow.log_artifacts(task['workdir'])
+            log_batch(params=to_params(implode_tree(task, separator='/')))
+
+            meter = Meter()
+            try:
+                task_function(task)
+            finally:
+                telemetry = meter.stop()
+
+            log_batch(metrics=to_metrics({f'telemetry/{name}': value for name, value in telemetry.items()}))
+
+            # close_task waits for the uploads.
+            artifacts = task.get('mlflow_artifacts', {})
+            submit_artifacts(task['workdir'], artifacts.get('include'), artifacts.get('max_bytes'))
 
     wrapper.__wrapped_function__ = task_function
-    return wrapper
\ No newline at end of file
+    return wrapper
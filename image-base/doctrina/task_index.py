@@ -0,0 +1,255 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Iterator, List, Optional, Tuple
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS tasks ('
+    'job TEXT, task_id TEXT, experiment TEXT, closed INTEGER, task TEXT, PRIMARY KEY (job, task_id))',
+    'CREATE TABLE IF NOT EXISTS tags ('
+    'job TEXT, task_id TEXT, key TEXT, value TEXT, PRIMARY KEY (job, task_id, key))',
+    'CREATE TABLE IF NOT EXISTS scans (job TEXT PRIMARY KEY, mtime INTEGER)',
+    'CREATE INDEX IF NOT EXISTS tasks_experiment ON tasks (job, experiment)',
+    'CREATE INDEX IF NOT EXISTS tasks_closed ON tasks (closed)',
+    'CREATE INDEX IF NOT EXISTS tags_value ON tags (key, value)',
+]
+
+# A job directory modified this recently may be modified again without a change of its mtime,
+# on filesystems that store the mtime in whole seconds or in coarse clock ticks.
+RACY_MTIME_NS = 2 * 10 ** 9
+
+# The mtime saved for a racy job directory, which the next scan takes as changed.
+RACY_SCAN = -1
+
+
+def is_task_tagged(task, tag_key, tag_value):
+    if 'tags' not in task:
+        return False
+
+    if tag_key not in task['tags']:
+        return False
+
+    return task['tags'][tag_key] == tag_value
+
+
+class TaskIndex:
+    """
+    An SQLite index of the tasks in a workspace, stored in {workspace}/tasks.sqlite.
+    The index is maintained by start_task and close_task, and every query scans the job directories
+    for the workdirs that were created, closed or removed by other means since the previous scan.
+    """
+
+    def __init__(self, workspace_path: str):
+        self.workspace_path = workspace_path
+        self.path = f'{workspace_path}/tasks.sqlite'
+
+    def connect(self) -> sqlite3.Connection:
+        os.makedirs(self.workspace_path, exist_ok=True)
+
+        # Parallel tasks of a pipeline write to the same index.
+        connection = sqlite3.connect(self.path, timeout=60)
+        for statement in SCHEMA:
+            connection.execute(statement)
+
+        return connection
+
+    def get_job_path(self, job):
+        return f'{self.workspace_path}/jobs/{job}'
+
+    def add(self, job, task_id, task: Optional[dict], closed=False):
+        with closing(self.connect()) as connection, connection:
+            self._add(connection, job, task_id, task, closed)
+
+    def close(self, job, task_id):
+        with closing(self.connect()) as connection, connection:
+            connection.execute('UPDATE tasks SET closed = 1 WHERE job = ? AND task_id = ?', (job, task_id))
+
+    def remove(self, job, task_id):
+        with closing(self.connect()) as connection, connection:
+            self._remove(connection, job, task_id)
+
+    def scan(self, job, force=False):
+        """
+        Indexes the workdirs of a job that were created, closed or removed since the last scan.
+        Only the new workdirs and the ones without a task are read, and only the open ones are checked for closing.
+        :param job:
+        :param force: if True, every workdir of the job is read again
+        """
+        job_path = self.get_job_path(job)
+        mtime = os.stat(job_path).st_mtime_ns if os.path.exists(job_path) else None
+
+        with closing(self.connect()) as connection:
+            indexed = {
+                task_id: (closed, task is not None)
+                for task_id, closed, task in connection.execute(
+                    'SELECT task_id, closed, task IS NOT NULL FROM tasks WHERE job = ?', (job,)
+                )
+            }
+
+            scanned = connection.execute('SELECT mtime FROM scans WHERE job = ?', (job,)).fetchone()
+
+            if force or scanned is None or scanned[0] != mtime:
+                # Creating or removing a workdir changes the mtime of the job directory.
+                task_ids = os.listdir(job_path) if mtime is not None else []
+            else:
+                task_ids = list(indexed)
+
+            # The task files are read before the write transaction,
+            # so that start_task and close_task of parallel tasks do not wait for the disk reads.
+            added = []
+            for task_id in task_ids:
+                workdir = f'{job_path}/{task_id}'
+                closed, has_task = indexed.get(task_id, (False, False))
+
+                if not force and closed:
+                    continue
+
+                now_closed = os.path.exists(f'{workdir}/closing.time')
+                if not force and has_task and not now_closed:
+                    continue
+
+                task = None
+                if os.path.exists(f'{workdir}/task.json'):
+                    with open(f'{workdir}/task.json', 'r') as f:
+                        task = json.loads(f.read())
+
+                added.append((task_id, task, now_closed))
+
+            # Like git with racily clean files, a directory whose mtime is as recent as the listing
+            # is listed again by the next scan, since it may have changed after the listing within the same tick.
+            if mtime is not None and time.time_ns() - mtime < RACY_MTIME_NS:
+                mtime = RACY_SCAN
+
+            with connection:
+                removed = [(job, task_id) for task_id in set(indexed) - set(task_ids)]
+                connection.executemany('DELETE FROM tasks WHERE job = ? AND task_id = ?', removed)
+                connection.executemany('DELETE FROM tags WHERE job = ? AND task_id = ?', removed)
+
+                self._add_many(connection, job, added)
+                connection.execute('INSERT OR REPLACE INTO scans (job, mtime) VALUES (?, ?)', (job, mtime))
+
+    def list_jobs(self) -> List[str]:
+        jobs_path = f'{self.workspace_path}/jobs'
+        return os.listdir(jobs_path) if os.path.exists(jobs_path) else []
+
+    def find(
+            self,
+            job=None,
+            experiment=None,
+            tag: Optional[Tuple[str, object]] = None,
+            closed: Optional[bool] = None,
+            with_experiment=False,
+    ) -> Iterator[Tuple[str, Optional[dict]]]:
+        """
+        :param job: the job to query, or None for all jobs of the workspace
+        :param experiment: the experiment name to match
+        :param tag: the (key, value) tag to match with ==, see is_task_tagged
+        :param closed: True for the closed tasks, False for the incomplete ones, None for both
+        :param with_experiment: if True, only the tasks with an experiment are matched
+        :return: the (workdir, task) pairs ordered by job and task id
+        """
+        jobs = self.list_jobs() if job is None else [job]
+        for j in jobs:
+            self.scan(j)
+
+        query = 'SELECT tasks.job, tasks.task_id, tasks.task FROM tasks'
+        conditions = []
+        params = []
+
+        if tag is not None:
+            # The values are compared in Python, where 1 == 1.0 == True and dicts ignore the key order.
+            query += ' JOIN tags ON tags.job = tasks.job AND tags.task_id = tasks.task_id'
+            conditions.append('tags.key = ?')
+            params.append(tag[0])
+
+        if job is not None:
+            conditions.append('tasks.job = ?')
+            params.append(job)
+
+        if experiment is not None:
+            conditions.append('tasks.experiment = ?')
+            params.append(experiment)
+
+        if with_experiment:
+            conditions.append('tasks.experiment IS NOT NULL')
+
+        if closed is not None:
+            conditions.append('tasks.closed = ?')
+            params.append(int(closed))
+
+        if len(conditions) > 0:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        query += ' ORDER BY tasks.job, tasks.task_id'
+
+        with closing(self.connect()) as connection:
+            rows = connection.execute(query, params).fetchall()
+
+        for row_job, task_id, task in rows:
+            task = None if task is None else json.loads(task)
+            if tag is not None and not is_task_tagged(task, *tag):
+                continue
+
+            yield f'{self.get_job_path(row_job)}/{task_id}', task
+
+    def last_workdir(self, job) -> Optional[str]:
+        self.scan(job)
+
+        with closing(self.connect()) as connection:
+            row = connection.execute(
+                'SELECT task_id FROM tasks WHERE job = ? ORDER BY task_id DESC LIMIT 1',
+                (job,)
+            ).fetchone()
+
+        return None if row is None else f'{self.get_job_path(job)}/{row[0]}'
+
+    @staticmethod
+    def _remove(connection, job, task_id):
+        connection.execute('DELETE FROM tasks WHERE job = ? AND task_id = ?', (job, task_id))
+        connection.execute('DELETE FROM tags WHERE job = ? AND task_id = ?', (job, task_id))
+
+    @staticmethod
+    def _add(connection, job, task_id, task: Optional[dict], closed):
+        TaskIndex._add_many(connection, job, [(task_id, task, closed)])
+
+    @staticmethod
+    def _add_many(connection, job, tasks: List[Tuple[str, Optional[dict], bool]]):
+        """
+        :param connection:
+        :param job:
+        :param tasks: the (task id, task, closed) to add or replace
+        """
+        connection.executemany(
+            'INSERT OR REPLACE INTO tasks (job, task_id, experiment, closed, task) VALUES (?, ?, ?, ?, ?)',
+            [
+                (job, task_id, None if task is None else task.get('experiment'),
+                 int(closed), None if task is None else json.dumps(task))
+                for task_id, task, closed in tasks
+            ]
+        )
+
+        connection.executemany(
+            'DELETE FROM tags WHERE job = ? AND task_id = ?',
+            [(job, task_id) for task_id, task, closed in tasks]
+        )
+        connection.executemany(
+            'INSERT INTO tags (job, task_id, key, value) VALUES (?, ?, ?, ?)',
+            [
+                (job, task_id, key, json.dumps(value, sort_keys=True))
+                for task_id, task, closed in tasks
+                if task is not None and isinstance(task.get('tags'), dict)
+                for key, value in task['tags'].items()
+            ]
+        )
+
+
+def get_workdir_index(workdir) -> Tuple[TaskIndex, str, str]:
+    """
+    :param workdir: a workdir in {workspace}/jobs/{job}/{task_id}
+    :return: the index of the workspace, the job and the task id
+    """
+    job_path, task_id = os.path.split(workdir)
+    jobs_path, job = os.path.split(job_path)
+    return TaskIndex(os.path.dirname(jobs_path)), job, task_id
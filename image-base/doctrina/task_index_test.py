@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import tempfile
+import sqlite3
+import time
+from contextlib import closing
+from unittest import TestCase, mock
+
+from doctrina import task_index
+from doctrina.task_index import TaskIndex
+
+
+class TaskIndexTest(TestCase):
+    def setUp(self):
+        workspace = tempfile.TemporaryDirectory()
+        self.addCleanup(workspace.cleanup)
+        self.index = TaskIndex(workspace.name)
+
+    def make_workdir(self, task_id, task: dict, closed=False) -> str:
+        workdir = f"{self.index.get_job_path('job')}/{task_id}"
+        os.makedirs(workdir)
+
+        with open(f"{workdir}/task.json", "w") as f:
+            f.write(json.dumps(task))
+        if closed:
+            open(f"{workdir}/closing.time", "w").close()
+
+        return workdir
+
+    def set_job_mtime(self, seconds):
+        os.utime(self.index.get_job_path("job"), (seconds, seconds))
+
+    def find_ids(self, **kwargs) -> list:
+        return [os.path.basename(workdir) for workdir, task in self.index.find(job="job", **kwargs)]
+
+    def test_add_close_remove(self):
+        task = {"experiment": "e", "tags": {"split": 1}}
+        workdir = self.make_workdir("1", task)
+        self.index.add("job", "1", task)
+
+        self.assertEqual(["1"], self.find_ids(closed=False))
+        self.assertEqual([], self.find_ids(closed=True))
+
+        self.index.close("job", "1")
+        self.assertEqual(["1"], self.find_ids(closed=True))
+
+        shutil.rmtree(workdir)
+        self.index.remove("job", "1")
+        self.assertEqual([], self.find_ids())
+
+    def test_queries(self):
+        self.make_workdir("1", {"experiment": "e", "tags": {"split": 1}}, closed=True)
+        self.make_workdir("2", {"tags": {"split": 2}})
+        self.make_workdir("3", {"experiment": "f", "tags": {"split": [1, 2]}})
+
+        self.assertEqual(["1", "2", "3"], self.find_ids())
+        self.assertEqual(["1"], self.find_ids(tag=("split", 1)))
+        self.assertEqual(["3"], self.find_ids(tag=("split", [1, 2])))
+        self.assertEqual([], self.find_ids(tag=("split", 3)))
+        self.assertEqual(["1"], self.find_ids(experiment="e"))
+        self.assertEqual(["1", "3"], self.find_ids(with_experiment=True))
+        self.assertEqual(["2", "3"], self.find_ids(closed=False))
+        self.assertTrue(self.index.last_workdir("job").endswith("/3"))
+
+    def test_tags_are_compared_like_python(self):
+        self.make_workdir("1", {"tags": {"n": 1, "config": {"a": 1, "b": [2]}}})
+        self.make_workdir("2", {"tags": {"n": 2}})
+
+        self.assertEqual(["1"], self.find_ids(tag=("n", 1.0)))
+        self.assertEqual(["1"], self.find_ids(tag=("n", True)))
+        self.assertEqual(["1"], self.find_ids(tag=("config", {"b": [2], "a": 1})))
+
+    def test_external_changes(self):
+        workdir = self.make_workdir("1", {})
+        self.set_job_mtime(time.time() - 100)
+        self.assertEqual(["1"], self.find_ids())
+
+        self.make_workdir("2", {})
+        self.assertEqual(["1", "2"], self.find_ids())
+
+        open(f"{workdir}/closing.time", "w").close()
+        self.assertEqual(["1"], self.find_ids(closed=True))
+
+        shutil.rmtree(workdir)
+        self.assertEqual(["2"], self.find_ids())
+
+    def test_task_files_are_read_outside_the_write_transaction(self):
+        self.index.add("job", "0", {})
+        self.make_workdir("1", {"experiment": "e"})
+        self.make_workdir("2", {"tags": {"n": 1}})
+
+        json_loads = json.loads
+
+        def loads(text):
+            # A parallel start_task must be able to write while the scan reads the task files.
+            with closing(sqlite3.connect(self.index.path, timeout=0)) as connection, connection:
+                connection.execute("UPDATE scans SET mtime = mtime WHERE job = 'other'")
+            return json_loads(text)
+
+        with mock.patch.object(task_index.json, "loads", side_effect=loads):
+            self.index.scan("job")
+
+        self.assertEqual(["1"], self.find_ids(experiment="e"))
+        self.assertEqual(["2"], self.find_ids(tag=("n", 1)))
+
+    def test_racy_mtime(self):
+        # A filesystem with whole-second mtimes does not change the mtime within the same second.
+        seconds = int(time.time())
+        self.make_workdir("1", {})
+        self.set_job_mtime(seconds)
+        self.assertEqual(["1"], self.find_ids())
+
+        self.make_workdir("2", {})
+        self.set_job_mtime(seconds)
+        self.assertEqual(["1", "2"], self.find_ids())
@@ -0,0 +1,130 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from doctrina import s3, task as task_module
+from doctrina.task import execute, mlflow_run, remove_workdirs, resolve_function
+from doctrina.telemetry import open_meters
+
+
+def fail_upload(client):
+    raise RuntimeError("s3 down")
+
+
+def upload_and_fail(task):
+    s3.submit_upload(fail_upload).exception()
+    raise ValueError("task failed")
+
+
+def do_nothing(task):
+    pass
+
+
+class ResolveFunctionTest(TestCase):
+    def test_cached_resolution(self):
+        resolve_function.cache_clear()
+
+        self.assertIs(do_nothing, resolve_function(__name__, "do_nothing"))
+        self.assertIs(os.path.join, resolve_function("os.path", "join"))
+        self.assertIs(do_nothing, resolve_function(__name__, "do_nothing"))
+
+        info = resolve_function.cache_info()
+        self.assertEqual((1, 2), (info.hits, info.misses))
+
+
+class ExecuteTest(TestCase):
+    def setUp(self):
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+
+        environment = {"APP_STORAGE_PATH": storage.name, "APP_S3_BUCKET_PRIVATE": ""}
+        for patcher in [mock.patch.dict(os.environ, environment), mock.patch.object(s3, "get_s3_client")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_failed_uploads_stay_with_their_task(self):
+        with self.assertRaises(ValueError):
+            execute({"function": [__name__, "upload_and_fail"], "workspace": "test"})
+
+        task = execute({"function": [__name__, "do_nothing"], "workspace": "test"})
+        self.assertTrue(os.path.exists(f"{task['workdir']}/closing.time"))
+
+    def test_missing_bucket_is_reported_once_per_upload(self):
+        with mock.patch("builtins.print") as print_:
+            execute({"function": [__name__, "do_nothing"], "workspace": "test"})
+
+        skipped = [c for c in print_.call_args_list if c.args == ("Skipping S3 upload due to missing bucket",)]
+        # Once when the task starts and once when it closes.
+        self.assertEqual(2, len(skipped))
+
+    def test_failed_tasks_stop_their_meter(self):
+        with self.assertRaises(ValueError):
+            execute({"function": [__name__, "upload_and_fail"], "workspace": "test"})
+
+        self.assertEqual([], open_meters)
+
+    def test_failed_mlflow_tasks_stop_their_meter(self):
+        @mlflow_run
+        def fail(task):
+            raise ValueError("task failed")
+
+        with mock.patch.object(task_module, "mlflow", mock.MagicMock()), \
+                mock.patch.object(task_module, "get_experiment_id"), \
+                mock.patch.object(task_module, "to_params"), \
+                mock.patch.object(task_module, "log_batch"):
+            with self.assertRaises(ValueError):
+                fail({"experiment": "test"})
+
+        self.assertEqual([], open_meters)
+
+
+class RemoveWorkdirsTest(TestCase):
+    def setUp(self):
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        self.storage = storage.name
+
+        self.client = mock.Mock()
+        self.client.get_paginator.return_value.paginate.side_effect = lambda Bucket, Prefix: [
+            {"Contents": [{"Key": f"{Prefix}task.json", "Size": 10}]},
+            {"Contents": [{"Key": f"{Prefix}model.h5", "Size": 90}]},
+        ]
+
+        environment = {"APP_STORAGE_PATH": storage.name, "APP_S3_BUCKET_PRIVATE": "bucket"}
+        for patcher in [
+            mock.patch.dict(os.environ, environment),
+            mock.patch.object(s3, "get_s3_client", return_value=self.client),
+            mock.patch("builtins.print"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_workdir(self, task_id) -> str:
+        workdir = f"{self.storage}/test/jobs/job/{task_id}"
+        os.makedirs(workdir)
+        with open(f"{workdir}/task.json", "w") as f:
+            f.write("{}")
+        return workdir
+
+    def test_dry_run(self):
+        workdirs = [self.make_workdir("1"), self.make_workdir("2")]
+
+        report = remove_workdirs(workdirs, dry_run=True)
+
+        self.assertEqual(
+            {"workdirs": 2, "local_files": 2, "local_bytes": 4, "s3_objects": 4, "s3_bytes": 200},
+            report,
+        )
+        self.assertTrue(all(os.path.exists(w) for w in workdirs))
+        self.client.delete_objects.assert_not_called()
+
+    def test_removal(self):
+        workdir = self.make_workdir("1")
+        self.client.delete_objects.return_value = {}
+
+        remove_workdirs([workdir])
+
+        self.assertFalse(os.path.exists(workdir))
+        keys = [o["Key"] for o in self.client.delete_objects.call_args.kwargs["Delete"]["Objects"]]
+        prefix = workdir.strip("/")
+        self.assertEqual([f"{prefix}/task.json", f"{prefix}/model.h5"], keys)
@@ -0,0 +1,143 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Uploads to S3 by this process, updated by the upload threads.
+upload_counters = {'s3_upload_seconds': 0.0, 's3_upload_bytes': 0}
+upload_lock = threading.Lock()
+
+# The meters that are running in this process, outermost first.
+open_meters = []
+
+
+def record_upload(seconds, size):
+    with upload_lock:
+        upload_counters['s3_upload_seconds'] += seconds
+        upload_counters['s3_upload_bytes'] += size
+
+
+def read_proc_status(field):
+    """
+    :param field: a field of /proc/self/status in kB, such as VmHWM
+    :return: bytes, or None where /proc is not available
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def get_peak_rss():
+    peak = read_proc_status('VmHWM')
+    if peak is not None:
+        return peak
+
+    # The peak of the whole process, in kB on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def read_io_counters() -> dict:
+    """
+    :return: the bytes this process read from and wrote to the storage
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return {'read_bytes': int(counters['read_bytes']), 'write_bytes': int(counters['write_bytes'])}
+    except OSError:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {'read_bytes': usage.ru_inblock * 512, 'write_bytes': usage.ru_oublock * 512}
+
+
+def read_counters() -> dict:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    with upload_lock:
+        uploads = upload_counters.copy()
+
+    return {
+        'wall_seconds': time.time(),
+        'cpu_seconds': usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime,
+        **read_io_counters(),
+        **uploads,
+    }
+
+
+class Meter:
+    """
+    Measures the wall time, CPU time, peak RSS, storage I/O and S3 uploads of this process
+    from its creation until stop(). Meters may be nested, for example a pipeline and its stages
+    executed in the same process, and each reports the peak RSS over its own lifetime.
+    """
+
+    def __init__(self):
+        self.peak_rss = 0
+        self.update_peaks()
+        reset_peak_rss()
+
+        open_meters.append(self)
+        self.start = read_counters()
+
+    @staticmethod
+    def update_peaks():
+        peak = get_peak_rss()
+        for meter in open_meters:
+            meter.peak_rss = max(meter.peak_rss, peak)
+
+    def stop(self) -> dict:
+        """
+        :return: the measurements by name
+        """
+        end = read_counters()
+
+        self.update_peaks()
+        if self in open_meters:
+            open_meters.remove(self)
+
+        telemetry = {name: end[name] - self.start[name] for name in end}
+        telemetry['peak_rss_bytes'] = self.peak_rss
+        return telemetry
+
+
+def aggregate_telemetry(telemetries: list, wall_seconds) -> dict:
+    """
+    :param telemetries: the telemetry of the tasks of a stage
+    :param wall_seconds: the time from the start of the stage to its end
+    :return: the total of the tasks, with the largest peak RSS of a single task
+    """
+    totals = {'wall_seconds': wall_seconds, 'tasks': len(telemetries)}
+
+    for name in ['cpu_seconds', 'read_bytes', 'write_bytes', 's3_upload_seconds', 's3_upload_bytes']:
+        totals[name] = sum(t.get(name, 0) for t in telemetries)
+
+    totals['peak_rss_bytes'] = max([t.get('peak_rss_bytes', 0) for t in telemetries], default=0)
+    return totals
+
+
+def load_telemetry(path) -> dict:
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
+
+def save_telemetry(path, telemetry: dict):
+    with open(path, 'w') as f:
+        f.write(json.dumps(telemetry, indent=True))
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from doctrina.telemetry import Meter, aggregate_telemetry
+
+
+class TelemetryTest(TestCase):
+    def test_nested_meters(self):
+        outer = Meter()
+        inner = Meter()
+        block = bytearray(64 * 2 ** 20)
+        block[::4096] = b'x' * len(block[::4096])
+        inner_telemetry = inner.stop()
+        del block
+
+        outer_telemetry = outer.stop()
+        self.assertGreaterEqual(inner_telemetry['peak_rss_bytes'], 64 * 2 ** 20)
+        self.assertGreaterEqual(outer_telemetry['peak_rss_bytes'], inner_telemetry['peak_rss_bytes'])
+        self.assertGreaterEqual(outer_telemetry['wall_seconds'], inner_telemetry['wall_seconds'])
+
+    def test_aggregate(self):
+        telemetries = [{'cpu_seconds': 1.0, 'peak_rss_bytes': 10}, {'cpu_seconds': 2.0, 'peak_rss_bytes': 30}]
+        totals = aggregate_telemetry(telemetries, 2.5)
+        self.assertEqual(3.0, totals['cpu_seconds'])
+        self.assertEqual(30, totals['peak_rss_bytes'])
+        self.assertEqual(2, totals['tasks'])
@@ -0,0 +1,123 @@
+import fnmatch
+import functools
+import os
+import time
+from concurrent.futures import Future
+
+from doctrina.lazy import lazy_import
+from doctrina.s3 import MANIFEST_NAME, submit_background_upload
+
+mlflow = lazy_import('mlflow')
+entities = lazy_import('mlflow.entities')
+tracking = lazy_import('mlflow.tracking')
+
+# The limits of a single log_batch request of the tracking server.
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_ENTITIES_PER_BATCH = 1000
+
+
+@functools.lru_cache(maxsize=None)
+def get_experiment_id(name) -> str:
+    """
+    :param name:
+    :return: the id of the experiment, which is created if it does not exist, cached for this process
+    """
+    experiment = mlflow.get_experiment_by_name(name)
+    if experiment is not None:
+        return experiment.experiment_id
+
+    try:
+        return mlflow.create_experiment(name)
+    except mlflow.exceptions.MlflowException:
+        # A parallel task created the experiment in the meantime.
+        return mlflow.get_experiment_by_name(name).experiment_id
+
+
+def get_active_run_id() -> str:
+    """
+    :return: the id of the active run, which is started if there is none, like the fluent API of mlflow does
+    """
+    run = mlflow.active_run()
+    if run is None:
+        run = mlflow.start_run()
+
+    return run.info.run_id
+
+
+def to_metrics(values: dict, step=0, timestamp=None) -> list:
+    timestamp = int(time.time() * 1000) if timestamp is None else timestamp
+    return [entities.Metric(key, float(value), timestamp, step) for key, value in values.items()]
+
+
+def to_params(values: dict) -> list:
+    return [entities.Param(key, str(value)) for key, value in values.items()]
+
+
+def log_batch(metrics: list = (), params: list = ()):
+    """
+    Logs to the active run in as few requests as the limits of the tracking server allow, see get_active_run_id.
+    :param metrics: the mlflow.entities.Metric to log
+    :param params: the mlflow.entities.Param to log
+    """
+    client = tracking.MlflowClient()
+    run_id = get_active_run_id()
+
+    metrics = list(metrics)
+    params = list(params)
+
+    while len(metrics) + len(params) > 0:
+        batch_params = params[:MAX_PARAMS_PER_BATCH]
+        batch_metrics = metrics[:min(MAX_METRICS_PER_BATCH, MAX_ENTITIES_PER_BATCH - len(batch_params))]
+
+        client.log_batch(run_id, metrics=batch_metrics, params=batch_params)
+
+        params = params[len(batch_params):]
+        metrics = metrics[len(batch_metrics):]
+
+
+def list_artifacts(workdir, include=None, max_bytes=None) -> list:
+    """
+    :param workdir:
+    :param include: the glob patterns of the relative paths to include, by default all files
+    :param max_bytes: the size above which files are left out
+    :return: the relative paths of the files to log
+    """
+    artifacts = []
+
+    for root, dirs, files in os.walk(workdir):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, workdir)
+            if relative == MANIFEST_NAME:
+                continue
+
+            if include is not None and not any(fnmatch.fnmatch(relative, pattern) for pattern in include):
+                continue
+
+            if max_bytes is not None and os.path.getsize(path) > max_bytes:
+                continue
+
+            artifacts.append(relative)
+
+    return artifacts
+
+
+def upload_artifacts(run_id, workdir, artifacts: list):
+    # The tracking client uploads to the artifact store of the run, not through the S3 client of doctrina.
+    client = tracking.MlflowClient()
+
+    for relative in artifacts:
+        client.log_artifact(run_id, f'{workdir}/{relative}', os.path.dirname(relative) or None)
+
+
+def submit_artifacts(workdir, include=None, max_bytes=None) -> Future:
+    """
+    Logs the files of the workdir to the active run in the background, see flush_uploads.
+    :param workdir:
+    :param include: the glob patterns of the relative paths to include, by default all files
+    :param max_bytes: the size above which files are left out
+    :return: the future of the upload
+    """
+    run_id = get_active_run_id()
+    return submit_background_upload(upload_artifacts, run_id, workdir, list_artifacts(workdir, include, max_bytes))
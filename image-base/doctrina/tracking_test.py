@@ -0,0 +1,50 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from doctrina import s3, tracking
+from doctrina.telemetry import upload_counters
+
+
+class TrackingTest(TestCase):
+    def setUp(self):
+        self.mlflow = mock.Mock()
+        self.mlflow.active_run.return_value = None
+        self.mlflow.start_run.return_value.info.run_id = "run"
+        self.client = mock.Mock()
+
+        for patcher in [
+            mock.patch.object(tracking, "mlflow", self.mlflow),
+            mock.patch.object(tracking, "tracking", mock.Mock(MlflowClient=mock.Mock(return_value=self.client))),
+            mock.patch.object(tracking, "entities", mock.Mock()),
+            mock.patch.object(s3, "get_s3_client", side_effect=AssertionError("S3 client requested")),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_log_batch_outside_a_run(self):
+        tracking.log_batch(metrics=tracking.to_metrics({f"m{i}": i for i in range(1500)}))
+
+        self.mlflow.start_run.assert_called_once()
+        self.assertEqual(
+            [("run", 1000), ("run", 500)],
+            [(c.args[0], len(c.kwargs["metrics"])) for c in self.client.log_batch.call_args_list],
+        )
+
+    def test_artifacts_bypass_s3(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        os.makedirs(f"{workdir.name}/plots")
+        for name in ["task.json", "plots/curve.png", s3.MANIFEST_NAME]:
+            open(f"{workdir.name}/{name}", "w").close()
+
+        seconds = upload_counters["s3_upload_seconds"]
+        tracking.submit_artifacts(workdir.name)
+        s3.flush_uploads()
+
+        self.assertEqual(
+            {("run", f"{workdir.name}/task.json", None), ("run", f"{workdir.name}/plots/curve.png", "plots")},
+            {c.args for c in self.client.log_artifact.call_args_list},
+        )
+        self.assertEqual(seconds, upload_counters["s3_upload_seconds"])
+        tracking.tracking.MlflowClient.assert_called_once()
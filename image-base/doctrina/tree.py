@@ -1,33 +1,118 @@
+from __future__ import annotations
+
+from doctrina.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+
 def implode_tree(tree: dict, separator: str) -> dict:
     imploded_tree = {}
 
-    for key, value in tree.items():
-        if type(value) != dict:
-            imploded_tree[key] = value
-            continue
+    # The items of the dictionaries on the current path, with their key prefixes.
+    # Iterators resume where they stopped, so the keys keep the order of the tree.
+    stack = [('', iter(tree.items()))]
+
+    while len(stack) > 0:
+        prefix, items = stack[-1]
 
-        imploded_value = implode_tree(value, separator)
-        imploded_value = {
-            key + separator + subkey: subvalue
-            for subkey, subvalue in imploded_value.items()
-        }
+        for key, value in items:
+            if type(value) == dict:
+                stack.append((prefix + key + separator, iter(value.items())))
+                break
 
-        imploded_tree.update(imploded_value)
+            imploded_tree[prefix + key] = value
+        else:
+            stack.pop()
 
     return imploded_tree
 
 
 def explode_tree(flat_tree: dict, separator: str) -> dict:
-    part_tree = {tuple(k.split(separator)): v for k, v in flat_tree.items()}
     exploded_tree = dict()
 
-    for (parts, value) in part_tree.items():
-        location = exploded_tree
-        for part in parts[:-1]:
-            if part not in location:
-                location[part] = dict()
-            location = location[part]
+    # The dictionaries by parent path, so that sibling keys find their parent without walking the tree.
+    locations = {}
+
+    for key, value in flat_tree.items():
+        parts = key.split(separator)
+        parent = tuple(parts[:-1])
+        leaf = parts[-1]
+
+        location = locations.get(parent)
+        if location is None:
+            location = exploded_tree
+            for part in parent:
+                if part not in location:
+                    location[part] = dict()
+                location = location[part]
+
+            locations[parent] = location
+
+        # A value that replaces a subtree detaches the cached dictionaries of the subtree,
+        # so the following keys walk the tree again and fail on the conflict.
+        if leaf in location and type(location[leaf]) == dict:
+            locations.clear()
+
+        location[leaf] = value
+
+    return exploded_tree
+
+
+def implode_trees(trees: list, separator: str, dtype=object) -> pd.DataFrame:
+    """
+    :param trees:
+    :param separator:
+    :param dtype: object keeps the values as they are, so that explode_frame restores the trees exactly,
+    None lets pandas infer the column types, such as float64 for integers with missing values
+    :return: a row per tree and a column per path, with NaN where a tree has no value
+    """
+    return pd.DataFrame([implode_tree(tree, separator) for tree in trees], dtype=dtype)
+
+
+def explode_frame(frame: pd.DataFrame, separator: str) -> list:
+    """
+    The inverse of implode_trees, where the NaN values are left out of the trees.
+    :param frame: a row per tree and a column per path
+    :param separator:
+    :return: the trees
+    """
+    paths = [column.split(separator) for column in frame.columns]
+    columns = [frame[column].tolist() for column in frame.columns]
+
+    trees = []
+    for row in zip(*columns):
+        tree = {}
+
+        for parts, value in zip(paths, row):
+            # NaN is the only value that differs from itself.
+            if value != value:
+                continue
+
+            location = tree
+            for part in parts[:-1]:
+                if part not in location:
+                    location[part] = dict()
+                location = location[part]
+
+            location[parts[-1]] = value
+
+        trees.append(tree)
+
+    return trees
+
+
+def merge_tree(tree: dict, update: dict) -> dict:
+    """
+    :param tree:
+    :param update: the values to set, nested dictionaries are merged into the ones of the tree
+    :return: a copy of the tree with the update
+    """
+    merged = dict(tree)
 
-        location[parts[-1]] = value
+    for key, value in update.items():
+        if type(value) == dict and type(merged.get(key)) == dict:
+            merged[key] = merge_tree(merged[key], value)
+        else:
+            merged[key] = value
 
-    return exploded_tree
\ No newline at end of file
+    return merged
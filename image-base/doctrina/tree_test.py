@@ -1,6 +1,8 @@
-from unittest import TestCase
+import os
+import time
+from unittest import TestCase, skipUnless
 
-from doctrina.tree import implode_tree, explode_tree
+from doctrina.tree import explode_frame, explode_tree, implode_tree, implode_trees
 
 separator = "__"
 tree_examples = [
@@ -39,4 +41,84 @@ class ExplodeImplodeTest(TestCase):
             actual = explode_tree(
                 implode_tree(example["exploded"], separator), separator
             )
-            self.assertEqual(expected, actual)
\ No newline at end of file
+            self.assertEqual(expected, actual)
+
+    def test_deep_tree(self):
+        tree = current = {}
+        for _ in range(5000):
+            current["k"] = {}
+            current = current["k"]
+        current["v"] = 1
+
+        imploded = implode_tree(tree, separator)
+        self.assertEqual(["k__" * 5000 + "v"], list(imploded))
+        # Comparing the trees themselves would exceed the recursion limit.
+        self.assertEqual(imploded, implode_tree(explode_tree(imploded, separator), separator))
+
+    def test_conflicts(self):
+        with self.assertRaises(TypeError):
+            explode_tree({"a__b": 1, "a": 5, "a__c": 2}, separator)
+        with self.assertRaises(TypeError):
+            explode_tree({"a__b__c": 1, "a": 5, "a__b__d": 2}, separator)
+        self.assertEqual({"a": 5}, explode_tree({"a__b": 1, "a": 5}, separator))
+
+    def test_separator_characters_in_keys(self):
+        self.assertEqual({"a": {"_b": 1}}, explode_tree({"a___b": 1}, separator))
+
+        tree = {"model": {"_private": 1, "units": 2}, "_hidden": {"_x": 3}}
+        self.assertEqual(tree, explode_tree(implode_tree(tree, separator), separator))
+        self.assertEqual(tree, explode_frame(implode_trees([tree], separator), separator)[0])
+
+    def test_frame_round_trip(self):
+        trees = [
+            {"a": {"b": 1, "c": [1, 2]}, "d": None},
+            {"a": {"b": 2.5}, "e": "x"},
+        ]
+        frame = implode_trees(trees, separator)
+        self.assertEqual(["a__b", "a__c", "d", "e"], list(frame.columns))
+        self.assertEqual(trees, explode_frame(frame, separator))
+
+
+def make_task(i):
+    return {
+        "function": ["jobs.train", "fit"],
+        "experiment": f"experiment_{i % 100}",
+        "model": {
+            "layers": [{"units": 64, "activation": "relu"}, {"units": 1}],
+            "optimizer": {"name": "adam", "params": {"lr": 0.001 * (i % 10), "beta_1": 0.9}},
+        },
+        "dataset": {"workdir": f"/storage/jobs/dataset/{i}", "split": {"train": 0.8, "test": 0.2}},
+        "epochs": 10 + i % 5,
+    }
+
+
+@skipUnless(os.environ.get("DOCTRINA_BENCHMARK"), "set DOCTRINA_BENCHMARK=1 to run the benchmarks")
+class ExplodeImplodeBenchmark(TestCase):
+    n = 20000
+
+    def test_benchmark(self):
+        tasks = [make_task(i) for i in range(self.n)]
+
+        start = time.perf_counter()
+        flat = [implode_tree(task, "/") for task in tasks]
+        implode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        exploded = [explode_tree(f, "/") for f in flat]
+        explode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        frame = implode_trees(tasks, "/")
+        frame_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        from_frame = explode_frame(frame, "/")
+        from_frame_seconds = time.perf_counter() - start
+
+        print(
+            f"{self.n} trees: implode {implode_seconds:.3f}s, explode {explode_seconds:.3f}s, "
+            f"implode_trees {frame_seconds:.3f}s, explode_frame {from_frame_seconds:.3f}s"
+        )
+
+        self.assertEqual(tasks, exploded)
+        self.assertEqual(tasks, from_frame)
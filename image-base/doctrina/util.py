@@ -1,18 +1,31 @@
+from __future__ import annotations
+
+import functools
 import json
 import math
 import os
 import pickle
 import subprocess
 
-import boto3
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import requests
-from sklearn.preprocessing import StandardScaler
-from tensorflow.python.keras import Model
+from typing import TYPE_CHECKING
+
+from doctrina.hdf import read_h5, write_h5
+from doctrina.lazy import lazy_import
+from doctrina.s3 import flush_uploads, submit_upload
+from doctrina.stream import ShuffledView
+from doctrina.versions import get_files_version
+
+if TYPE_CHECKING:
+    from sklearn.preprocessing import StandardScaler
+    from tensorflow.python.keras import Model
 
-from doctrina.dataset import Dataset
+    from doctrina.dataset import Dataset
+
+plt = lazy_import('matplotlib.pyplot')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+requests = lazy_import('requests')
+preprocessing = lazy_import('sklearn.preprocessing')
 
 
 def save_learning_curve(workdir, history, metrics=('loss',)):
@@ -56,34 +69,96 @@ def load_input_y(hyperparams):
     return train_y, validate_y
 
 
-def train_scaler(train_X, validate_X, test_X):
-    scaler = StandardScaler()
+def train_scaler(train_X, validate_X, test_X, chunk_size=None, in_place=False):
+    """
+    :param train_X:
+    :param validate_X:
+    :param test_X:
+    :param chunk_size: the number of rows to fit and transform at a time, or None for all rows at once
+    :param in_place: if True, the given frames are scaled in place instead of being copied
+    :return:
+    """
+    scaler = fit_scaler(iter_chunks(train_X, chunk_size))
 
-    train_X_scaled = pd.DataFrame(
-        scaler.fit_transform(train_X),
-        columns=train_X.columns
-    )
+    train_X_scaled = scale_frame(scaler, train_X, chunk_size, in_place)
+    validate_X_scaled = scale_frame(scaler, validate_X, chunk_size, in_place)
+    test_X_scaled = scale_frame(scaler, test_X, chunk_size, in_place)
 
-    validate_X_scaled = pd.DataFrame(
-        scaler.transform(validate_X),
-        columns=validate_X.columns
-    )
+    return scaler, train_X_scaled, validate_X_scaled, test_X_scaled
 
-    test_X_scaled = pd.DataFrame(
-        scaler.transform(test_X),
-        columns=test_X.columns
-    )
 
-    return scaler, train_X_scaled, validate_X_scaled, test_X_scaled
+def chunk_bounds(nrows, chunk_size=None):
+    if chunk_size is None:
+        chunk_size = max(1, nrows)
+
+    for start in range(0, nrows, chunk_size):
+        yield start, min(start + chunk_size, nrows)
+
+
+def iter_chunks(frame: pd.DataFrame, chunk_size=None):
+    for start, stop in chunk_bounds(frame.shape[0], chunk_size):
+        yield frame.iloc[start:stop]
+
+
+def fit_scaler(chunks) -> StandardScaler:
+    """
+    Fits a scaler incrementally, so that the training data does not have to fit in memory.
+    :param chunks: frames or arrays, for example from iter_chunks or Dataset.stream_pq_workdir
+    :return:
+    """
+    scaler = preprocessing.StandardScaler()
+
+    for chunk in chunks:
+        scaler.partial_fit(chunk)
+
+    return scaler
+
+
+def scale_frame(scaler: StandardScaler, frame: pd.DataFrame, chunk_size=None, in_place=False) -> pd.DataFrame:
+    """
+    Transforms a frame chunk by chunk, so that only one chunk is held twice in memory.
+    :param scaler:
+    :param frame:
+    :param chunk_size: the number of rows to transform at a time, or None for all rows at once
+    :param in_place: if True, the frame itself is updated and returned, which requires float columns
+    :return:
+    """
+    if in_place:
+        for start, stop in chunk_bounds(frame.shape[0], chunk_size):
+            frame.iloc[start:stop, :] = scaler.transform(frame.iloc[start:stop])
+
+        return frame
+
+    dtype = np.result_type(*frame.dtypes)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+
+    scaled = np.empty(frame.shape, dtype=dtype)
+
+    for start, stop in chunk_bounds(frame.shape[0], chunk_size):
+        scaled[start:stop] = scaler.transform(frame.iloc[start:stop])
+
+    return pd.DataFrame(scaled, columns=frame.columns, copy=False)
 
 
 def shuffle(X, y, seed):
+    # A local RandomState gives the same order as seeding the global one, without mutating it.
     idx = np.arange(X.shape[0])
-    np.random.seed(seed)
-    np.random.shuffle(idx)
+    np.random.RandomState(seed).shuffle(idx)
     return X.iloc[idx], y.iloc[idx]
 
 
+def shuffle_view(X, y, seed=None) -> ShuffledView:
+    """
+    Shuffles X and y without copying them, see ShuffledView.
+    :param X:
+    :param y:
+    :param seed:
+    :return:
+    """
+    return ShuffledView((X, y), seed=seed)
+
+
 def build_plot_predictions(
         model,
         train_X,
@@ -102,27 +177,76 @@ def build_plot_predictions(
     )
 
 
-def save_scaler(workdir, scaler):
-    params = {
-        'mean' : list(scaler.mean_),
-        'scale': list(scaler.scale_)
-    }
+SCALER_FILES = [
+    'scaler_mean.npy',
+    'scaler_scale.npy',
+    'scaler_var.npy',
+    'scaler_n_samples_seen.npy',
+    'scaler_features.json',
+    'scaler_params.json',
+]
 
-    path = f'{workdir}/scaler_params.json'
 
-    with open(path, 'w') as f:
-        f.write(json.dumps(params, indent=True))
+def save_scaler_array(workdir, name, array):
+    # Each file is replaced at once, so that load_scaler never reads a partly written scaler file.
+    with open(f'{workdir}/{name}.tmp', 'wb') as f:
+        np.save(f, np.asarray(array))
+    os.replace(f'{workdir}/{name}.tmp', f'{workdir}/{name}')
 
 
-def load_scaler(workdir) -> StandardScaler:
-    path = f'{workdir}/scaler_params.json'
+def save_scaler(workdir, scaler):
+    save_scaler_array(workdir, 'scaler_mean.npy', scaler.mean_)
+    save_scaler_array(workdir, 'scaler_scale.npy', scaler.scale_)
+    save_scaler_array(workdir, 'scaler_var.npy', scaler.var_)
+    save_scaler_array(workdir, 'scaler_n_samples_seen.npy', scaler.n_samples_seen_)
 
-    with open(path, 'r') as f:
-        params = json.loads(f.read())
+    if hasattr(scaler, 'feature_names_in_'):
+        with open(f'{workdir}/scaler_features.json.tmp', 'w') as f:
+            f.write(json.dumps(list(scaler.feature_names_in_), indent=True))
+        os.replace(f'{workdir}/scaler_features.json.tmp', f'{workdir}/scaler_features.json')
 
-    scaler = StandardScaler()
-    scaler.mean_ = params['mean']
-    scaler.scale_ = params['scale']
+
+def load_scaler(workdir) -> StandardScaler:
+    """
+    Loads a fitted scaler, which is cached per process until the saved scaler changes.
+    The returned scaler is shared between callers, so it must not be refitted.
+    :param workdir:
+    :return:
+    """
+    version = get_files_version([f'{workdir}/{name}' for name in SCALER_FILES])
+    if version is None:
+        # Loads the scaler without caching it.
+        return load_scaler_version.__wrapped__(workdir, version)
+
+    return load_scaler_version(workdir, version)
+
+
+@functools.lru_cache(maxsize=32)
+def load_scaler_version(workdir, version) -> StandardScaler:
+    scaler = preprocessing.StandardScaler()
+
+    if os.path.exists(f'{workdir}/scaler_mean.npy'):
+        scaler.mean_ = np.load(f'{workdir}/scaler_mean.npy')
+        scaler.scale_ = np.load(f'{workdir}/scaler_scale.npy')
+    else:
+        # Workdirs saved before the binary format.
+        with open(f'{workdir}/scaler_params.json', 'r') as f:
+            params = json.loads(f.read())
+
+        # The variance and the number of samples were not saved, so the scaler can only transform,
+        # and partial_fit starts over.
+        scaler.mean_ = np.array(params['mean'])
+        scaler.scale_ = np.array(params['scale'])
+
+    if os.path.exists(f'{workdir}/scaler_var.npy'):
+        scaler.var_ = np.load(f'{workdir}/scaler_var.npy')
+        scaler.n_samples_seen_ = np.load(f'{workdir}/scaler_n_samples_seen.npy')[()]
+
+    scaler.n_features_in_ = scaler.mean_.shape[0]
+
+    if os.path.exists(f'{workdir}/scaler_features.json'):
+        with open(f'{workdir}/scaler_features.json', 'r') as f:
+            scaler.feature_names_in_ = np.array(json.loads(f.read()), dtype=object)
 
     return scaler
 
@@ -210,17 +334,20 @@ def save_predictions(workdir: str, model: Model, dataset: Dataset):
     validate_y_hat = pd.Series(model.predict(dataset.validate_X).reshape(-1))
     test_y_hat = pd.Series(model.predict(dataset.test_X).reshape(-1))
 
-    train_y_hat.to_hdf(f'{workdir}/predictions.h5', 'train_y_hat')
-    validate_y_hat.to_hdf(f'{workdir}/predictions.h5', 'validate_y_hat')
-    test_y_hat.to_hdf(f'{workdir}/predictions.h5', 'test_y_hat')
+    return write_h5(f'{workdir}/predictions.h5', {
+        'train_y_hat'   : train_y_hat,
+        'validate_y_hat': validate_y_hat,
+        'test_y_hat'    : test_y_hat,
+    }, mode='w')
 
 
 def load_predictions(workdir: str):
-    train_y_hat = pd.read_hdf(f'{workdir}/predictions.h5', 'train_y_hat')
-    validate_y_hat = pd.read_hdf(f'{workdir}/predictions.h5', 'validate_y_hat')
-    test_y_hat = pd.read_hdf(f'{workdir}/predictions.h5', 'test_y_hat')
+    predictions = read_h5(
+        f'{workdir}/predictions.h5',
+        ['train_y_hat', 'validate_y_hat', 'test_y_hat']
+    )
 
-    return train_y_hat, validate_y_hat, test_y_hat
+    return predictions['train_y_hat'], predictions['validate_y_hat'], predictions['test_y_hat']
 
 
 def save_notebook(workdir: str, task: dict):
@@ -273,42 +400,67 @@ def send_slack(message, attachments):
     }
 
     print(json.dumps(body, indent=True))
+
+    # Slack fetches the linked artifacts right away.
+    flush_uploads()
     requests.post(slack_url, json=body)
 
 
-def save_public_s3(path: str, body: bytes, content_type: str):
+def save_public_s3(path: str, body: bytes, content_type: str, wait=False):
+    """
+    :param path:
+    :param body:
+    :param content_type:
+    :param wait: if False, the upload continues in the background until flush_uploads
+    :return: the public URL
+    """
     bucket_name = os.getenv('PUBLIC_S3_BUCKET')
 
     remote_path = path if path[0] != '/' else path[1:]
 
-    s3 = boto3.client('s3')
-    s3.put_object(
-        Body=body,
-        Bucket=bucket_name,
-        Key=remote_path,
-        ACL='public-read',
-        ContentType=content_type
-    )
+    def put(s3):
+        s3.put_object(
+            Body=body,
+            Bucket=bucket_name,
+            Key=remote_path,
+            ACL='public-read',
+            ContentType=content_type
+        )
+
+    future = submit_upload(put)
+    if wait:
+        future.result()
 
     return to_public_s3_url(path)
 
 
-def save_public_s3_file(path, content_type):
+def save_public_s3_file(path, content_type, wait=False):
+    """
+    :param path:
+    :param content_type:
+    :param wait: if False, the upload continues in the background until flush_uploads,
+    so the file must not change until then
+    :return: the public URL
+    """
     bucket_name = os.getenv('PUBLIC_S3_BUCKET')
 
     local_path = path
     remote_path = path if path[0] != '/' else path[1:]
 
-    s3 = boto3.client('s3')
-    s3.upload_file(
-        local_path,
-        bucket_name,
-        remote_path,
-        ExtraArgs={
-            'ACL'        : 'public-read',
-            'ContentType': content_type
-        }
-    )
+    def upload(s3):
+        s3.upload_file(
+            local_path,
+            bucket_name,
+            remote_path,
+            ExtraArgs={
+                'ACL'        : 'public-read',
+                'ContentType': content_type
+            }
+        )
+
+    future = submit_upload(upload)
+    if wait:
+        future.result()
 
     return to_public_s3_url(path)
 
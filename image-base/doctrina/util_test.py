@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+from doctrina.util import load_scaler, save_scaler, scale_frame, shuffle_view, train_scaler
+
+
+def make_frame(nrows, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "small": rng.normal(0.1, 0.01, nrows),
+        "large": rng.normal(1000, 300, nrows),
+        "constant": np.full(nrows, 5.0),
+    })
+
+
+class ScalerTest(TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+
+    def test_chunked_fit_matches_fit_transform(self):
+        train_X, validate_X, test_X = make_frame(1000, 0), make_frame(300, 1), make_frame(200, 2)
+        expected = StandardScaler()
+        expected_train_X = expected.fit_transform(train_X)
+
+        scaler, train_X_scaled, validate_X_scaled, test_X_scaled = train_scaler(
+            train_X, validate_X, test_X, chunk_size=128
+        )
+
+        np.testing.assert_allclose(expected.mean_, scaler.mean_)
+        np.testing.assert_allclose(expected.var_, scaler.var_)
+        np.testing.assert_allclose(expected_train_X, train_X_scaled.to_numpy(), atol=1e-10)
+        np.testing.assert_allclose(expected.transform(test_X), test_X_scaled.to_numpy(), atol=1e-10)
+        self.assertEqual(list(train_X.columns), list(validate_X_scaled.columns))
+        self.assertEqual(1000, scaler.n_samples_seen_)
+
+    def test_in_place(self):
+        train_X = make_frame(100, 0)
+        scaler = StandardScaler().fit(train_X)
+        expected = scaler.transform(train_X)
+
+        scaled = scale_frame(scaler, train_X, chunk_size=30, in_place=True)
+
+        self.assertIs(train_X, scaled)
+        np.testing.assert_allclose(expected, train_X.to_numpy())
+
+    def test_round_trip(self):
+        train_X = make_frame(100, 0)
+        scaler = StandardScaler().fit(train_X)
+
+        save_scaler(self.workdir, scaler)
+        loaded = load_scaler(self.workdir)
+
+        for attribute in ["mean_", "scale_", "var_"]:
+            np.testing.assert_array_equal(getattr(scaler, attribute), getattr(loaded, attribute))
+        self.assertEqual(100, loaded.n_samples_seen_)
+        self.assertEqual(list(train_X.columns), list(loaded.feature_names_in_))
+        np.testing.assert_array_equal(scaler.transform(train_X), loaded.transform(train_X))
+
+    def test_legacy_params(self):
+        with open(f"{self.workdir}/scaler_params.json", "w") as f:
+            f.write(json.dumps({"mean": [1.0, 2.0], "scale": [2.0, 1.0]}))
+
+        scaler = load_scaler(self.workdir)
+
+        self.assertFalse(hasattr(scaler, "var_"))
+        np.testing.assert_array_equal([[0.0, 1.0]], scaler.transform(np.array([[1.0, 3.0]])))
+
+    def test_cache_follows_the_saved_scaler(self):
+        # Saving a scaler again within the same mtime tick gives files of the same size.
+        save_scaler(self.workdir, StandardScaler().fit(make_frame(100, 0)))
+        self.assertAlmostEqual(1000, load_scaler(self.workdir).mean_[1], delta=100)
+        save_scaler(self.workdir, StandardScaler().fit(make_frame(100, 1) * 2))
+        self.assertAlmostEqual(2000, load_scaler(self.workdir).mean_[1], delta=100)
+
+        # Only the scalers that were not saved just now are cached.
+        for name in os.listdir(self.workdir):
+            os.utime(f"{self.workdir}/{name}", (0, 0))
+        first = load_scaler(self.workdir)
+        self.assertIs(first, load_scaler(self.workdir))
+
+        save_scaler(self.workdir, StandardScaler().fit(make_frame(100, 2) * 3))
+        second = load_scaler(self.workdir)
+        self.assertIsNot(first, second)
+        self.assertAlmostEqual(3000, second.mean_[1], delta=100)
+
+
+class ShuffleViewTest(TestCase):
+    def test_batches_keep_rows_aligned(self):
+        X = pd.DataFrame({"a": np.arange(23.0)})
+        y = pd.DataFrame({"y": np.arange(23) * 10})
+
+        batches = list(shuffle_view(X, y, seed=0).batches(5))
+
+        self.assertEqual([5, 5, 5, 5, 3], [bx.shape[0] for bx, by in batches])
+        for bx, by in batches:
+            self.assertEqual((bx["a"] * 10).astype(int).tolist(), by["y"].tolist())
+
+        streamed = pd.concat([bx for bx, by in batches])
+        self.assertNotEqual(list(range(23)), streamed["a"].tolist())
+        pd.testing.assert_frame_equal(X, streamed.sort_values("a"))
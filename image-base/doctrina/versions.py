@@ -0,0 +1,32 @@
+import os
+import time
+from typing import Optional
+
+from doctrina.task_index import RACY_MTIME_NS
+
+
+def get_files_version(paths) -> Optional[tuple]:
+    """
+    Identifies the contents of several files for caching what is loaded from them.
+    Files written with os.replace get a new inode, and like the job directories of the task index,
+    a file modified as recently as now may be modified again without a change of its size or mtime.
+    :param paths:
+    :return: the inode, size and mtime of every file, None for the missing ones,
+    or None if any of them was modified too recently to be cached
+    """
+    version = []
+    now = time.time_ns()
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            version.append(None)
+            continue
+
+        if now - stat.st_mtime_ns < RACY_MTIME_NS:
+            return None
+
+        version.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+
+    return tuple(version)